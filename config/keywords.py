@@ -0,0 +1,34 @@
+# 本地关键词预过滤词表：消息中不包含任何关键词时不进入（或低优先级进入）LLM分析
+# 每个类别同时收录简体、繁体和英文写法，英文匹配不区分大小写且只匹配完整单词（允许复数等词尾）
+# 可通过环境变量 PREFILTER_KEYWORDS_FILE 指定同结构的JSON文件替换默认词表
+prefilter_keywords = {
+    "leaders": [
+        "习近平", "習近平", "Xi Jinping", "XiJinping", "习主席", "習主席", "习大大", "習大大",
+        "习总书记", "習總書記", "包子", "庆丰", "慶豐", "维尼", "維尼", "Winnie",
+        "李强", "李強", "Li Qiang", "赵乐际", "趙樂際", "王沪宁", "王滬寧", "蔡奇",
+        "丁薛祥", "李希", "韩正", "韓正", "王毅", "Wang Yi", "彭丽媛", "彭麗媛",
+        "中共", "共产党", "共產黨", "CCP", "CPC", "Communist Party", "政治局", "总书记", "總書記",
+        "国家主席", "國家主席", "领导人", "領導人", "中央",
+    ],
+    "places": [
+        "中国", "中國", "大陆", "大陸", "内地", "內地", "China", "Chinese", "PRC", "Mainland",
+        "北京", "Beijing", "上海", "Shanghai", "广州", "廣州", "深圳", "武汉", "武漢",
+        "天安门", "天安門", "Tiananmen", "中南海", "Zhongnanhai",
+        "台湾", "台灣", "臺灣", "Taiwan", "香港", "Hong Kong", "澳门", "澳門",
+        "新疆", "Xinjiang", "西藏", "Tibet", "火车站", "火車站", "车站", "車站", "政府", "人民大会堂", "人民大會堂",
+    ],
+    "actions": [
+        "抗议", "抗議", "protest", "游行", "遊行", "示威", "demonstration", "集会", "集會", "rally",
+        "横幅", "橫幅", "banner", "标语", "標語", "传单", "傳單", "挂", "掛",
+        "炸", "爆炸", "bomb", "explosive", "袭击", "襲擊", "attack", "暗杀", "暗殺", "刺杀", "刺殺",
+        "罢工", "罷工", "strike", "起义", "起義", "推翻", "overthrow", "革命", "revolution",
+        "暴动", "暴動", "riot", "纵火", "縱火", "arson", "自焚", "下台", "下臺",
+    ],
+    "foreign_officials": [
+        "赖清德", "賴清德", "Lai Ching-te", "William Lai", "蔡英文", "Tsai Ing-wen",
+        "特朗普", "川普", "Trump", "拜登", "Biden", "鲁比奥", "盧比奧", "Rubio",
+        "普京", "普丁", "Putin", "石破茂", "Ishiba", "岸田", "Kishida", "尹锡悦", "尹錫悅",
+        "涉华", "涉華", "对华", "對華", "中美", "美中", "两岸", "兩岸", "cross-strait",
+        "制裁", "sanction", "关税", "關稅", "tariff", "外交部", "白宫", "白宮", "White House",
+    ],
+}
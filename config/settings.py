@@ -1,4 +1,5 @@
 import os
+import json
 from typing import Optional
 from utils.logger_config import LoggerConfig
 from dotenv import load_dotenv
@@ -41,6 +42,18 @@ class Settings:
         self.openai_base_url: str = os.environ.get('OPENAI_BASE_URL', 'https://concept.dica.cc/llm')
         if not self.openai_api_key:
             self.logger.warning("OPENAI_API_KEY not set in environment variables")
+        # 共享连接池配置，所有LLM调用复用同一组连接
+        self.openai_timeout: float = float(os.environ.get('OPENAI_TIMEOUT', 300))
+        self.openai_max_connections: int = int(os.environ.get('OPENAI_MAX_CONNECTIONS', 50))
+        # LLM请求调度：最大并发、最大排队数（超过后丢弃最低优先级的后台请求）、每个模型的每分钟请求数和token数
+        self.llm_max_concurrency: int = int(os.environ.get('LLM_MAX_CONCURRENCY', 8))
+        self.llm_max_queue_depth: int = int(os.environ.get('LLM_MAX_QUEUE_DEPTH', 200))
+        self.llm_default_rate_limit: dict = {
+            'rpm': int(os.environ.get('LLM_DEFAULT_RPM', 300)),
+            'tpm': int(os.environ.get('LLM_DEFAULT_TPM', 1000000)),
+        }
+        # 按模型覆盖默认限制，例如：{"gemini-2.0-flash-001": {"rpm": 600, "tpm": 2000000}}
+        self.llm_rate_limits: dict = json.loads(os.environ.get('LLM_RATE_LIMITS', '{}'))
         
         # Apify Configuration
         self.apify_token: str = os.environ.get('APIFY_TOKEN')
@@ -55,6 +68,120 @@ class Settings:
         
         # Model Configuration
         self.model_id: str = os.environ.get('MODEL_ID', 'gemini-2.0-flash-001')
+        # 模型路由：分类类调用使用快速模型，总结类调用使用大模型；主模型超过p95延迟（不超过SLO）未返回时对冲请求备用模型，备用模型为空则不对冲
+        self.classifier_model_id: str = os.environ.get('CLASSIFIER_MODEL_ID', self.model_id)
+        self.summarizer_model_id: str = os.environ.get('SUMMARIZER_MODEL_ID', self.model_id)
+        self.fallback_model_id: str = os.environ.get('FALLBACK_MODEL_ID', '')
+        self.llm_routes: dict = {
+            'analyze_message': {'model': self.classifier_model_id, 'fallback_model': self.fallback_model_id, 'slo_seconds': 15},
+            'parse_query': {'model': self.classifier_model_id, 'fallback_model': self.fallback_model_id, 'slo_seconds': 10},
+            'news_translate': {'model': self.classifier_model_id, 'fallback_model': self.fallback_model_id, 'slo_seconds': 30},
+            'news_summarize': {'model': self.summarizer_model_id, 'fallback_model': self.fallback_model_id, 'slo_seconds': 60},
+            'analyze_content': {'model': self.summarizer_model_id, 'fallback_model': self.fallback_model_id, 'slo_seconds': 60},
+            'summarize_tweets': {'model': self.summarizer_model_id, 'fallback_model': self.fallback_model_id, 'slo_seconds': 90},
+            'analyze_scheduled_messages': {'model': self.summarizer_model_id, 'fallback_model': self.fallback_model_id, 'slo_seconds': 180},
+        }
+        # 按调用点覆盖路由，例如：{"analyze_message": {"model": "gemini-2.0-flash-lite", "slo_seconds": 8}}
+        for route_name, route in json.loads(os.environ.get('LLM_ROUTES', '{}')).items():
+            self.llm_routes.setdefault(route_name, {}).update(route)
+
+        # 群组消息批量分析配置：在时间窗口内收集消息，或达到最大条数时合并为一次LLM请求
+        self.batch_window_seconds: float = float(os.environ.get('BATCH_WINDOW_SECONDS', 2.0))
+        self.batch_max_size: int = int(os.environ.get('BATCH_MAX_SIZE', 20))
+        self.batch_low_priority_window_seconds: float = float(os.environ.get('BATCH_LOW_PRIORITY_WINDOW_SECONDS', 30.0))
+        self.batch_low_priority_max_size: int = int(os.environ.get('BATCH_LOW_PRIORITY_MAX_SIZE', 50))
+
+        # 群组消息处理队列：并发处理的worker数、队列最大长度、队列满时的策略（block 阻塞、drop_oldest 丢弃最旧、spill 溢出到磁盘）
+        self.ingest_workers: int = int(os.environ.get('INGEST_WORKERS', 64))
+        self.ingest_queue_size: int = int(os.environ.get('INGEST_QUEUE_SIZE', 2000))
+        self.ingest_overflow_policy: str = os.environ.get('INGEST_OVERFLOW_POLICY', 'block')
+        self.ingest_spill_path: str = os.environ.get('INGEST_SPILL_PATH', './cache/ingest_spill.jsonl')
+
+        # 半小时消息缓冲上限：单个群组和全局的最大条数与字节数，超出后淘汰最早的消息
+        self.buffer_max_messages_per_group: int = int(os.environ.get('BUFFER_MAX_MESSAGES_PER_GROUP', 2000))
+        self.buffer_max_bytes_per_group: int = int(os.environ.get('BUFFER_MAX_BYTES_PER_GROUP', 1024 * 1024))
+        self.buffer_max_messages: int = int(os.environ.get('BUFFER_MAX_MESSAGES', 100000))
+        self.buffer_max_bytes: int = int(os.environ.get('BUFFER_MAX_BYTES', 64 * 1024 * 1024))
+
+        # 缓冲消息的磁盘日志：目录（为空表示关闭）、批量fsync的间隔（秒）、单个日志段的最大字节数
+        self.spool_dir: str = os.environ.get('SPOOL_DIR', './cache/spool')
+        self.spool_fsync_interval: float = float(os.environ.get('SPOOL_FSYNC_INTERVAL', 1.0))
+        self.spool_segment_bytes: int = int(os.environ.get('SPOOL_SEGMENT_BYTES', 16 * 1024 * 1024))
+
+        # 告警媒体中转：内存缓冲上限（超出后写入临时文件）、可转发的最大文件大小（Bot API上传限制50MB）、最大并发下载数
+        self.media_memory_bytes: int = int(os.environ.get('MEDIA_MEMORY_BYTES', 8 * 1024 * 1024))
+        self.media_max_bytes: int = int(os.environ.get('MEDIA_MAX_BYTES', 50 * 1024 * 1024))
+        self.media_max_concurrent_downloads: int = int(os.environ.get('MEDIA_MAX_CONCURRENT_DOWNLOADS', 4))
+        self.media_temp_dir: str = os.environ.get('MEDIA_TEMP_DIR', './temp/')
+
+        # 相册收集窗口（秒）：同一相册的消息在窗口内没有新成员后合并处理，0表示关闭
+        self.album_window_seconds: float = float(os.environ.get('ALBUM_WINDOW_SECONDS', 1.0))
+
+        # 消息编辑后与原文的相似度低于该阈值时才重新分析，否则只更新缓冲中的文本
+        self.edit_similarity_threshold: float = float(os.environ.get('EDIT_SIMILARITY_THRESHOLD', 0.85))
+
+        # 断线补抓：各源群组最后消息ID的保存路径、补抓并发数、单个群组最多补抓条数、连接检查间隔（秒）
+        self.high_water_path: str = os.environ.get('HIGH_WATER_PATH', './cache/high_water_marks.json')
+        self.backfill_concurrency: int = int(os.environ.get('BACKFILL_CONCURRENCY', 4))
+        self.backfill_max_messages: int = int(os.environ.get('BACKFILL_MAX_MESSAGES', 500))
+        self.connection_check_interval: float = float(os.environ.get('CONNECTION_CHECK_INTERVAL', 30))
+
+        # 发送者信息缓存：最大条数和有效期（秒）
+        self.sender_cache_size: int = int(os.environ.get('SENDER_CACHE_SIZE', 10000))
+        self.sender_cache_ttl: float = float(os.environ.get('SENDER_CACHE_TTL', 3600))
+
+        # Bot发送限速：全局每秒条数，群组和私聊每分钟条数
+        self.send_global_rate: float = float(os.environ.get('SEND_GLOBAL_RATE', 30))
+        self.send_group_rate_per_minute: float = float(os.environ.get('SEND_GROUP_RATE_PER_MINUTE', 20))
+        self.send_private_rate_per_minute: float = float(os.environ.get('SEND_PRIVATE_RATE_PER_MINUTE', 60))
+
+        # 新闻和推文结果合并后超过该条数时改为发送一个Markdown文件，0表示不发送文件
+        self.result_document_threshold: int = int(os.environ.get('RESULT_DOCUMENT_THRESHOLD', 5))
+
+        # /get_history 默认和最多获取的历史消息条数
+        self.history_default_limit: int = int(os.environ.get('HISTORY_DEFAULT_LIMIT', 50))
+        self.history_max_limit: int = int(os.environ.get('HISTORY_MAX_LIMIT', 5000))
+
+        # 告警汇总窗口（秒）：同一源群组的首条告警立即发送，窗口内的后续告警合并为一条汇总，0表示逐条发送
+        self.alert_digest_window: float = float(os.environ.get('ALERT_DIGEST_WINDOW', 60))
+
+        # 持久化发送队列：数据库目录、最多尝试次数、退避基数和上限（秒）、每批重发条数、空闲轮询间隔（秒）
+        self.outbox_dir: str = os.environ.get('OUTBOX_DIR', './cache')
+        self.outbox_max_attempts: int = int(os.environ.get('OUTBOX_MAX_ATTEMPTS', 8))
+        self.outbox_base_delay: float = float(os.environ.get('OUTBOX_BASE_DELAY', 2))
+        self.outbox_max_delay: float = float(os.environ.get('OUTBOX_MAX_DELAY', 300))
+        self.outbox_batch_size: int = int(os.environ.get('OUTBOX_BATCH_SIZE', 50))
+        self.outbox_poll_interval: float = float(os.environ.get('OUTBOX_POLL_INTERVAL', 5))
+
+        # 记录最近消息文本的条数，用于判断编辑是否改动了文本（与半小时缓冲无关）
+        self.edit_tracking_size: int = int(os.environ.get('EDIT_TRACKING_SIZE', 50000))
+
+        # 流式回复时编辑Telegram消息的最小间隔（秒），避免触发编辑频率限制
+        self.stream_edit_interval: float = float(os.environ.get('STREAM_EDIT_INTERVAL', 1.5))
+
+        # 半小时消息分析单次LLM调用的输入token预算，超出后分段并行总结再合并
+        self.summary_token_budget: int = int(os.environ.get('SUMMARY_TOKEN_BUDGET', 24000))
+
+        # 本地关键词预过滤：off 关闭，skip 未命中关键词的消息跳过LLM分析，low_priority 未命中的消息进入低优先级批次
+        self.prefilter_mode: str = os.environ.get('PREFILTER_MODE', 'low_priority')
+        self.prefilter_keywords_file: str = os.environ.get('PREFILTER_KEYWORDS_FILE', '')
+
+        # 跨群组近似重复消息合并：滑动窗口（秒，0表示关闭）、SimHash最大汉明距离、参与去重的最短文本长度
+        self.dedup_window_seconds: float = float(os.environ.get('DEDUP_WINDOW_SECONDS', 600))
+        self.dedup_max_distance: int = int(os.environ.get('DEDUP_MAX_DISTANCE', 3))
+        self.dedup_min_length: int = int(os.environ.get('DEDUP_MIN_LENGTH', 20))
+
+        # LLM响应缓存配置：内存LRU + SQLite磁盘两级缓存
+        self.llm_cache_path: str = os.environ.get('LLM_CACHE_PATH', './cache/llm_cache.sqlite3')
+        self.llm_cache_memory_size: int = int(os.environ.get('LLM_CACHE_MEMORY_SIZE', 2048))
+        self.llm_cache_disk_size: int = int(os.environ.get('LLM_CACHE_DISK_SIZE', 100000))
+        # 各调用点的缓存有效期（秒），0表示不缓存
+        self.llm_cache_ttls: dict = {
+            'analyze_message': int(os.environ.get('LLM_CACHE_TTL_ANALYZE_MESSAGE', 86400)),
+            'parse_query': int(os.environ.get('LLM_CACHE_TTL_PARSE_QUERY', 3600)),
+            'analyze_content': int(os.environ.get('LLM_CACHE_TTL_ANALYZE_CONTENT', 1800)),
+            'summarize_tweets': int(os.environ.get('LLM_CACHE_TTL_SUMMARIZE_TWEETS', 21600)),
+        }
         
         news_sources = [
     "bbc.com",
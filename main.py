@@ -44,7 +44,7 @@ def main():
     输入 /twitter_user [user id] 来查询推特用户，例如：/twitter_user elonmusk （请注意user id不是user name）
     输入 /hourly [news/twitter] [特朗普/elonmusk]来设置定时推送新闻或twitter用户推文，例如："/hourly news 特朗普" 或"/hourly /twitter elonmusk"
     输入 /stop [news/twitter] 来停止定时推送
-    输入 /get_history [源群组ID/用户名/邀请链接] [查询句] 来获取并分析群组历史消息
+    输入 /get_history [源群组ID/用户名/邀请链接] [选项] [查询句] 来获取并分析群组历史消息，选项：limit=条数 since=开始日期 until=结束日期 mode=forward/digest
 """)
 
         # Initialize forward bot
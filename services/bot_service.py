@@ -1,26 +1,44 @@
 import asyncio
-from datetime import datetime, timedelta
+import difflib
+import html
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
 from pprint import pprint
 from typing import Optional
 from telegram import Update
-from telegram.constants import ParseMode
+from telegram.constants import ChatType, ParseMode
 from telegram.ext import Application, CommandHandler, CallbackContext, ContextTypes, TypeHandler
 import telegram
 from config.settings import settings
 from services.news_service import NewsService
 from services.x_service import ApifyConfig, ApifyService, XScraper
-from utils.utils import parse_query, analyze_content, read_tweets_ids, summarize_tweets, write_tweets_ids, analyze_message, analyze_scheduled_messages
+from utils.utils import OpenAIService, parse_query, analyze_content_stream, read_tweets_ids, summarize_tweets, write_tweets_ids, analyze_message, analyze_messages_batch, analyze_scheduled_messages
+from utils.message_batcher import MessageBatcher
+from utils.prefilter import KeywordPrefilter
+from utils.dedup import NearDuplicateIndex
+from utils.ingest_queue import IngestQueue
+from utils.message_buffer import MessageBufferPool
+from utils.message_spool import MessageSpool
+from utils.media_relay import MediaRelay
+from utils.album_collector import AlbumCollector
+from utils.high_water import HighWaterMarks
+from utils.sender_cache import SenderCache
+from utils.llm_scheduler import Priority
+from utils.send_dispatcher import Lane, get_send_dispatcher
+from utils.result_packer import send_items
+from utils.alert_aggregator import AlertAggregator
+from utils.outbox import Outbox
 from telethon.tl.types import User, Chat, Channel
 
 import os
 import json
 import time
-import re
 
 # 导入Telethon相关库
 from telethon import TelegramClient, events
 from telethon.sessions import StringSession
 from telethon import functions
+from telethon.errors import FloodWaitError
 
 logger = settings.get_logger(__name__)
 
@@ -39,12 +57,60 @@ class TelegramBotService:
         self.config_file = "./forward_configs.json"
         # 转发配置列表
         self.forward_configs = self.load_forward_configs()
-        # 消息处理器字典，用于管理和移除
-        self.message_handlers = {}
-        # 存储半小时内的群组消息用于定时分析
-        self.group_messages = {}
+        # 转发路由表：源群组peer ID -> {配置ID: 转发目标}，由唯一的新消息处理器查询
+        self.source_routes = {}
+        # 配置ID -> 源群组peer ID，用于移除和检查路由
+        self.config_routes = {}
+        # 目标群组ID（字符串）-> {配置ID: 源群组}，定时分析只遍历触发的目标群组自己的配置
+        self.target_index = {}
+        # 已注册新消息分发处理器的Telethon客户端
+        self._dispatcher_client = None
+        # 存储半小时内的群组消息用于定时分析，按群组和全局限制条数与字节数
+        self.group_messages = MessageBufferPool()
+        # 缓冲消息同时追加写入磁盘日志，重启后恢复尚未分析的消息
+        self.message_spool = MessageSpool() if settings.spool_dir else None
         # 存储定时任务引用用于在stop_forward中移除任务
         self.scheduled_jobs = {}
+        # 跨群组合并消息，批量进行LLM分析
+        self.message_batcher = MessageBatcher(
+            classify_batch=analyze_messages_batch,
+            classify_one=lambda text, low_priority=False: analyze_message(message=text, low_priority=low_priority)
+        )
+        # LLM分析前的本地关键词预过滤
+        self.prefilter = KeywordPrefilter()
+        # 跨群组的近似重复消息索引，重复消息复用首条消息的分析结果
+        self.dedup_index = NearDuplicateIndex()
+        # 告警消息的媒体中转：内存缓冲下载、限制并发、复用已上传的file_id
+        self.media_relay = MediaRelay()
+        # 相册的多条消息合并为一个整体处理
+        self.album_collector = AlbumCollector(on_album=self.dispatch_album)
+        # 各源群组最后收到的消息ID，重连后据此补抓断线期间的消息
+        self.high_water = HighWaterMarks()
+        # (源群组ID, 消息ID) -> 最近一次看到的文本，编辑事件据此判断文本是否变化，不受缓冲取走或淘汰影响
+        self.last_texts = OrderedDict()
+        # 发送者信息缓存，告警和历史消息直接使用预先生成的发送者文本
+        self.sender_cache = SenderCache()
+        # 告警和定时报告先写入SQLite发送队列，送达后才删除，失败时退避重试，重启后继续发送
+        self.outbox = Outbox(
+            path=os.path.join(settings.outbox_dir, f"outbox_{bot_type}.db"),
+            on_migrated=self._update_migrated_chat_id
+        )
+        # 同一源群组的连续告警合并为汇总消息，首条告警立即发送
+        self.alert_aggregator = AlertAggregator(send=self._send_alert)
+        self._backfill_pause_until = 0.0
+        # 重连后各源群组收到的第一条实时消息ID，补抓只补到这条消息之前
+        self._backfill_ceilings = {}
+        self._backfill_task = None
+        self._connection_watchdog = None
+        # 保存重建路由任务的引用，避免任务在执行中被垃圾回收
+        self._route_tasks = set()
+        # 有界的消息处理队列，由固定数量的worker消费
+        self.ingest_queue = IngestQueue(
+            handler=lambda job: self._process_message(**job),
+            serialize=self._serialize_ingest_job,
+            restore=self._restore_ingest_job,
+            discard=self._discard_ingest_job
+        )
         
     def load_forward_configs(self) -> list:
         """从JSON文件加载转发配置"""
@@ -79,6 +145,55 @@ class TelegramBotService:
             logger.error(f"Error initializing X service: {e}")
             return None
 
+    @staticmethod
+    async def _edit_streaming_text(message, text: str) -> float:
+        """编辑流式消息，返回Telegram要求的等待秒数（无需等待时为0）"""
+        try:
+            await message.edit_text(text)
+        except telegram.error.RetryAfter as e:
+            return e.retry_after
+        except telegram.error.BadRequest as e:
+            # 内容未变化时Telegram会拒绝编辑，可以忽略
+            if "not modified" not in str(e):
+                raise
+        return 0
+
+    async def send_streaming_reply(self, bot, chat_id, chunks) -> str:
+        """先发送占位消息，在LLM逐步生成内容时按节流间隔编辑该消息，返回完整文本"""
+        limit = 4096
+        # 占位消息和超长时另起的消息经发送调度器限速，之后的编辑按自己的节流间隔进行
+        dispatcher = get_send_dispatcher(bot)
+        message = await dispatcher.send_message(bot, chat_id, "⏳ 正在生成分析...", lane=Lane.INTERACTIVE)
+        text = ''
+        offset = 0  # 当前消息对应全文的起始位置，超出长度时另起一条消息
+        next_edit = time.monotonic() + settings.stream_edit_interval
+
+        async def flush():
+            nonlocal message, offset
+            while len(text) - offset > limit:
+                cut = text.rfind('\n', offset, offset + limit)
+                if cut <= offset:
+                    cut = offset + limit
+                await self._edit_streaming_text(message, text[offset:cut])
+                offset = cut
+                message = await dispatcher.send_message(bot, chat_id, text[offset:offset + limit].strip() or '...',
+                                                        lane=Lane.INTERACTIVE)
+            return await self._edit_streaming_text(message, text[offset:].strip() or '...')
+
+        async for delta in chunks:
+            text += delta
+            if time.monotonic() >= next_edit:
+                retry_after = await flush()
+                next_edit = time.monotonic() + max(settings.stream_edit_interval, retry_after)
+
+        if not text.strip():
+            text = '（未生成分析结果）'
+        retry_after = await flush()
+        if retry_after:
+            await asyncio.sleep(retry_after)
+            await flush()
+        return text
+
     async def start(self, update: Update, context: CallbackContext) -> None:
         """Handle /start command."""
         await update.message.reply_text(self.start_message)
@@ -122,25 +237,24 @@ class TelegramBotService:
                         await update.message.reply_text("未找到相关推文，请尝试换个话题或拉长时间间隔")
                     continue
                 
-                tweets = summarize_tweets(raw_tweets)
+                tweets = await summarize_tweets(raw_tweets, chat_key=update.effective_chat.id)
                 
-                for tweet in tweets:
-                    try:
-                        await update.message.reply_text(text=tweet)
-                        await asyncio.sleep(0.5)
-                    except telegram.error.RetryAfter as e:
-                        await asyncio.sleep(e.retry_after)
-                        await update.message.reply_text(text=tweet)
+                # 推文合并为尽量少的消息发送，结果过多时发送文件
+                await send_items(context.bot, update.effective_chat.id, tweets, header=f'关于 {query} 的推文（{len(tweets)} 条）')
 
                 # Analyze tweets
                 try:
                     formatted_tweets = "\n\n".join(tweets)
-                    analysis = analyze_content(
-                        formatted_tweets,
-                        query,
-                        task_type="推特帖子"
+                    await self.send_streaming_reply(
+                        context.bot,
+                        update.effective_chat.id,
+                        analyze_content_stream(
+                            formatted_tweets,
+                            query,
+                            task_type="推特帖子",
+                            chat_key=update.effective_chat.id
+                        )
                     )
-                    await update.message.reply_text(text=analysis)
                 except Exception as e:
                     logger.error(f"Failed to analyze tweets: {e}")
                     await update.message.reply_text("推文分析失败，但已为您展示所有推文")
@@ -180,15 +294,9 @@ class TelegramBotService:
             await update.message.reply_text("未找到相关推文，请检查用户id是否正确")
             return
         
-        tweets = summarize_tweets(raw_tweets)
+        tweets = await summarize_tweets(raw_tweets, chat_key=update.effective_chat.id)
         
-        for tweet in tweets:
-            try:
-                await update.message.reply_text(text=tweet)
-                await asyncio.sleep(0.5)
-            except telegram.error.RetryAfter as e:
-                await asyncio.sleep(e.retry_after)
-                await update.message.reply_text(text=tweet)
+        await send_items(context.bot, update.effective_chat.id, tweets, header=f'{user_id} 最近{months_back}个月的推文（{len(tweets)} 条）')
         
 
     async def news_command(self, update: Update, context: CallbackContext) -> None:
@@ -204,7 +312,9 @@ class TelegramBotService:
         max_retries = 3
         for retry in range(max_retries):
             try:
-                news_items = self.news_service.get_news(
+                # CodeAgent是同步的，放到线程中执行以免阻塞事件循环
+                news_items = await asyncio.to_thread(
+                    self.news_service.get_news,
                     query,
                     date=datetime.now().strftime("%Y-%m-%d %H:%M:%S")
                     )
@@ -219,25 +329,21 @@ class TelegramBotService:
                     await update.message.reply_text(news_items)
                     return
 
-                await update.message.reply_text(f'获取到了{len(news_items)}条新闻')
-                
-                for article in news_items:
-                    try:
-                        await update.message.reply_text(text=article)
-                        await asyncio.sleep(0.5)
-                    except telegram.error.RetryAfter as e:
-                        await asyncio.sleep(e.retry_after)
-                        await update.message.reply_text(text=article)
+                await send_items(context.bot, update.effective_chat.id, news_items, header=f'获取到了{len(news_items)}条新闻')
 
                 # Analyze news
                 try:
                     formatted_news = "\n\n".join(news_items)
-                    analysis = analyze_content(
-                        formatted_news,
-                        query,
-                        task_type="新闻报道"
+                    await self.send_streaming_reply(
+                        context.bot,
+                        update.effective_chat.id,
+                        analyze_content_stream(
+                            formatted_news,
+                            query,
+                            task_type="新闻报道",
+                            chat_key=update.effective_chat.id
+                        )
                     )
-                    await update.message.reply_text(text=analysis)
                 except Exception as e:
                     logger.error(f"Failed to analyze news: {e}")
                     await update.message.reply_text("新闻分析失败，但已为您展示所有新闻")
@@ -254,54 +360,41 @@ class TelegramBotService:
         job_data = context.job.data
         query = f"{job_data['message']} **in recent 1 hour**"
         news_service = job_data['news_service']
+        dispatcher = get_send_dispatcher(context.bot)
         
         logger.info(f"Sending scheduled news update for query: {query}")
         
         try:
-            news_items = news_service.get_news(
+            news_items = await asyncio.to_thread(
+                news_service.get_news,
                 query,
                 date=datetime.now().strftime("%Y-%m-%d %H:%M:%S")
             )
 
             if not news_items:
-                await context.bot.send_message(
-                    chat_id=job_data['chat_id'],
-                    text=f"最近一小时并无关于{job_data['message']}的新闻"
+                await dispatcher.send_message(
+                    context.bot, job_data['chat_id'],
+                    f"最近一小时并无关于{job_data['message']}的新闻",
+                    lane=Lane.REPORT
                 )
                 return
 
             if isinstance(news_items, str):
-                await context.bot.send_message(
-                    chat_id=job_data['chat_id'],
-                    text=news_items
-                )
+                await dispatcher.send_message(context.bot, job_data['chat_id'], news_items, lane=Lane.REPORT)
                 return
             
-            await context.bot.send_message(
-                chat_id=job_data['chat_id'],
-                text=f'Hourly news about: {job_data["message"]}'
+            await send_items(
+                context.bot,
+                job_data['chat_id'],
+                news_items,
+                header=f'Hourly news about: {job_data["message"]}',
+                lane=Lane.REPORT
             )
 
-            for article in news_items:
-                try:
-                    await context.bot.send_message(
-                        chat_id=job_data['chat_id'],
-                        text=article
-                    )
-                    await asyncio.sleep(0.5)
-                except telegram.error.RetryAfter as e:
-                    await asyncio.sleep(e.retry_after)
-                    await context.bot.send_message(
-                        chat_id=job_data['chat_id'],
-                        text=article
-                    )
-
         except Exception as e:
             logger.error(f"Error in scheduled news: {e}")
-            await context.bot.send_message(
-                chat_id=job_data['chat_id'],
-                text="获取定时新闻时出错，请稍后重试"
-            )
+            await dispatcher.send_message(context.bot, job_data['chat_id'], "获取定时新闻时出错，请稍后重试",
+                                          lane=Lane.REPORT)
 
     @staticmethod
     async def send_scheduled_tweets(context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -312,15 +405,13 @@ class TelegramBotService:
         x_scraper = job_data['x_scraper']
         
         logger.info(f"Sending scheduled tweets update for user id: {user_id}")
+        dispatcher = get_send_dispatcher(context.bot)
     
         
         raw_tweets = await x_scraper.get_profile_tweets(user_id, 1)
                     
         if not raw_tweets:
-            await context.bot.send_message(
-                        chat_id=chat_id,
-                        text="未找到相关推文，请检查用户id是否正确"
-                    )
+            await dispatcher.send_message(context.bot, chat_id, "未找到相关推文，请检查用户id是否正确", lane=Lane.REPORT)
             return
         
         old_ids = read_tweets_ids()
@@ -329,27 +420,12 @@ class TelegramBotService:
         if set(new_ids) - set(old_ids):
             write_tweets_ids(new_ids)
             
-            tweets = summarize_tweets(raw_tweets)
+            tweets = await summarize_tweets(raw_tweets, priority=Priority.REPORT, chat_key=chat_id)
             
-            for tweet in tweets:
-                try:
-                    await context.bot.send_message(
-                        chat_id=chat_id,
-                        text=tweet
-                    )
-                    await asyncio.sleep(0.5)
-                except telegram.error.RetryAfter as e:
-                    await asyncio.sleep(e.retry_after)
-                    await context.bot.send_message(
-                        chat_id=chat_id,
-                        text=tweet
-                    )
+            await send_items(context.bot, chat_id, tweets, lane=Lane.REPORT)
         else:
             now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            await context.bot.send_message(
-                        chat_id=chat_id,
-                        text=f"没有新的推文, 时间：{now}"
-                    )
+            await dispatcher.send_message(context.bot, chat_id, f"没有新的推文, 时间：{now}", lane=Lane.REPORT)
                 
         
     async def hourly(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -392,10 +468,9 @@ class TelegramBotService:
             x_scraper = await self.initialize_x_service()
         
             if not x_scraper:
-                await context.bot.send_message(
-                            chat_id=chat_id,
-                            text="Twitter服务初始化失败，请稍后重试"
-                        )
+                await get_send_dispatcher(context.bot).send_message(
+                    context.bot, chat_id, "Twitter服务初始化失败，请稍后重试", lane=Lane.INTERACTIVE
+                )
                 return
             
             new_job = context.job_queue.run_repeating(
@@ -476,9 +551,16 @@ class TelegramBotService:
                     return
                 self.telethon_client = client
             
-            # 清空旧处理器
+            # 断开前复制各群组的最后消息ID，重连期间的实时消息会推进记录，补抓必须从断开前的位置开始
+            backfill_marks = self.high_water.snapshot()
+            self._backfill_ceilings = {}
+            
+            # 重新连接并清空旧路由
             await self.telethon_client.disconnect()
             await self.telethon_client.connect()
+            self.source_routes.clear()
+            self.config_routes.clear()
+            self.target_index.clear()
             
             restored_count = 0
             for config in self.forward_configs:
@@ -517,25 +599,14 @@ class TelegramBotService:
                                 # 所有尝试都失败
                                 logger.error(f"无法使用任何ID格式获取实体: {source_chat}")
                                 continue
-                    target_chat = config['target_chat']
-                    group_name = config['group_name']
-                    config_id = config['id']
-                    
-                    # 创建新处理器前断开旧连接
-                    if self.message_handlers.get(config['id']):
-                        self.message_handlers[config['id']].disconnect()
-                    
-                    # 使用通用方法创建消息处理器
-                    forward_handler = self.create_forward_handler(
+                    # 加入转发路由表
+                    await self.add_forward_route(
                         client=self.telethon_client,
                         source_chat=source_chat,
-                        target_chat=target_chat,
-                        group_name=group_name,
-                        bot=self.application.bot
+                        target_chat=config['target_chat'],
+                        group_name=config['group_name'],
+                        config_id=config['id']
                     )
-                    
-                    # 保存处理器引用
-                    self.message_handlers[config_id] = forward_handler
                     restored_count += 1
                     
                 except Exception as e:
@@ -543,193 +614,494 @@ class TelegramBotService:
                 finally:
                     asyncio.sleep(0.5)  # 短暂延迟以避免过度请求
             
-            logger.info(f"成功恢复 {restored_count}/{len(self.forward_configs)} 个消息处理器")
+            logger.info(f"成功恢复 {restored_count}/{len(self.forward_configs)} 个转发配置，监听 {len(self.source_routes)} 个源群组")
             # 添加连接状态检查（调试用）
             logger.info(f"当前客户端连接状态: {self.telethon_client.is_connected()}")
             logger.info(f"活跃事件处理器数量: {len(self.telethon_client.list_event_handlers())}")
             
+            # 补抓重连前后遗漏的消息
+            if self._backfill_task is None or self._backfill_task.done():
+                self._backfill_task = asyncio.create_task(self.backfill_gaps(backfill_marks))
+            
         except Exception as e:
             logger.error(f"恢复消息处理器过程中出错: {e}")
 
-    # 创建消息转发处理器以便在forward_new和restore_message_handlers中复用
-    def create_forward_handler(self, client, source_chat, target_chat, group_name, bot=None):
-        """创建消息转发处理器函数"""
-        @client.on(events.NewMessage(chats=source_chat))
-        async def forward_handler(event):
-            """处理新消息并转发"""
+    def _ensure_dispatcher(self, client):
+        """在Telethon客户端上注册唯一的新消息分发处理器"""
+        if self._dispatcher_client is client:
+            return
+        client.add_event_handler(self.dispatch_new_message, events.NewMessage())
+        client.add_event_handler(self.dispatch_edited_message, events.MessageEdited())
+        self._dispatcher_client = client
+        if self._connection_watchdog is None:
+            self._connection_watchdog = asyncio.create_task(self.watch_connection())
+
+    # 转发配置的路由表维护，在forward_new、stop_forward和restore_message_handlers中复用
+    async def add_forward_route(self, client, source_chat, target_chat, group_name, config_id=None):
+        """把转发配置加入路由表，返回源群组的peer ID"""
+        self._ensure_dispatcher(client)
+        peer_id = await client.get_peer_id(source_chat)
+        config_id = config_id or f"{source_chat}_{target_chat}"
+        self.remove_forward_route(config_id)
+        self.source_routes.setdefault(peer_id, {})[config_id] = {
+            'source_chat': source_chat,
+            'target_chat': target_chat,
+            'group_name': group_name
+        }
+        self.config_routes[config_id] = peer_id
+        self.target_index.setdefault(str(target_chat), {})[config_id] = source_chat
+        return peer_id
+
+    def remove_forward_route(self, config_id):
+        """从路由表中移除转发配置"""
+        peer_id = self.config_routes.pop(config_id, None)
+        routes = self.source_routes.get(peer_id)
+        if routes is not None:
+            route = routes.pop(config_id, None)
+            if not routes:
+                del self.source_routes[peer_id]
+            if route is not None:
+                configs = self.target_index.get(str(route['target_chat']))
+                if configs is not None:
+                    configs.pop(config_id, None)
+                    if not configs:
+                        del self.target_index[str(route['target_chat'])]
+
+    @staticmethod
+    def _serialize_ingest_job(job) -> dict:
+        """溢出到磁盘时只保存消息定位信息，回放时重新拉取消息"""
+        return {
+            'chat_id': job['message'].chat_id,
+            'msg_id': job['message'].id,
+            'config_id': job.get('config_id'),
+            'source_chat': job['source_chat'],
+            'target_chat': job['target_chat'],
+            'group_name': job['group_name']
+        }
+
+    async def _restore_ingest_job(self, record: dict):
+        """根据溢出记录重新拉取消息，消息已删除时返回None"""
+        message = await self.telethon_client.get_messages(record['chat_id'], ids=record['msg_id'])
+        if not message:
+            return None
+        return {
+            'message': message,
+            'config_id': record.get('config_id'),
+            'source_chat': record['source_chat'],
+            'target_chat': record['target_chat'],
+            'group_name': record['group_name']
+        }
+
+    @staticmethod
+    def _discard_ingest_job(job):
+        """消息被丢弃或溢出时结束其重复消息组的等待"""
+        cluster = job.get('cluster')
+        if cluster is not None and job.get('is_first') and not cluster.verdict.done():
+            cluster.verdict.set_result(None)
+
+    async def dispatch_new_message(self, event):
+        """唯一的新消息处理器，按源群组ID查路由表，分发给该群组的所有转发配置"""
+        if event.chat_id in self.source_routes:
+            # 用更新自带的用户和群组信息批量填充发送者缓存
+            # 注意：_entities是Telethon事件的内部属性（更新附带的实体表），没有公开接口，升级Telethon时需确认仍然存在
+            self.sender_cache.add_entities(getattr(event, '_entities', {}).values())
+        await self._dispatch_message(event.chat_id, event.message)
+
+    async def _dispatch_message(self, chat_id, message, backfill=False):
+        """把一条消息分发给源群组的所有转发配置，补抓的消息带backfill标记"""
+        routes = self.source_routes.get(chat_id)
+        if not routes:
+            return
+        if not backfill:
+            self._backfill_ceilings.setdefault(chat_id, message.id)
+        self.high_water.observe(chat_id, message.id)
+        try:
+            # 记录所有收到的消息，包括消息类型
+            msg_type = "未知类型"
+            if message.text:
+                msg_type = "文本消息"
+            elif message.media:
+                msg_type = "媒体消息"
+            elif message.sticker:
+                msg_type = "贴纸"
+            elif message.document:
+                msg_type = "文档"
+            elif message.voice:
+                msg_type = "语音消息"
+            elif message.video:
+                msg_type = "视频"
+            elif message.video_note:
+                msg_type = "视频笔记"
+            elif message.gif:
+                msg_type = "GIF"
+
+            # 先记录原始消息，确保我们看到了所有消息
+            group_names = ', '.join(sorted({route['group_name'] for route in routes.values()}))
+            logger.info(f"{'[补抓] ' if backfill else ''}消息ID: {message.id} 消息来源：{chat_id} ({group_names}) 消息类型：{msg_type} 消息内容: {message.text[:100] if message.text else '非文本消息'}{'...' if (message.text and len(message.text) > 100) else ''}")
+            
+            if message.text:
+                self._remember_text(chat_id, message.id, message.text)
+            
+            # 相册消息先暂存，收齐后作为一个整体分发
+            if not backfill and self.album_collector.add(message):
+                return
+            
+            for config_id, route in list(routes.items()):
+                await self._route_message(config_id, message, route['source_chat'], route['target_chat'], route['group_name'], backfill=backfill)
+        
+        except Exception as e:
+            logger.error(f"Error forwarding message via Telethon: {e}")
+
+    async def dispatch_album(self, messages, backfill=False):
+        """分发收齐的相册，以带说明文字的那条消息代表整个相册进行分析"""
+        routes = self.source_routes.get(messages[0].chat_id)
+        if not routes:
+            return
+        for item in messages:
+            if not backfill:
+                self._backfill_ceilings.setdefault(item.chat_id, item.id)
+            self.high_water.observe(item.chat_id, item.id)
+        message = next((item for item in messages if item.text), messages[0])
+        if message.text:
+            self._remember_text(message.chat_id, message.id, message.text)
+        logger.info(f"相册 {message.grouped_id} 共 {len(messages)} 条媒体，合并处理")
+        for config_id, route in list(routes.items()):
+            await self._route_message(config_id, message, route['source_chat'], route['target_chat'], route['group_name'], album=messages, backfill=backfill)
+
+    async def watch_connection(self):
+        """定期检查Telethon连接，断线后重新连接并补抓断线期间的消息"""
+        while True:
+            await asyncio.sleep(settings.connection_check_interval)
+            if not self.source_routes:
+                continue
+            if self.telethon_client is None or not self.telethon_client.is_connected():
+                logger.warning("Telethon客户端已断开，正在重新连接...")
+                await self.restore_message_handlers()
+
+    async def backfill_gaps(self, marks):
+        """按断开前各源群组的最后消息ID并发补抓遗漏的消息"""
+        client = self.telethon_client
+        peers = [peer_id for peer_id in list(self.source_routes) if marks.get(str(peer_id))]
+        if not client or not peers:
+            return
+        semaphore = asyncio.Semaphore(settings.backfill_concurrency)
+        results = await asyncio.gather(*(
+            self._backfill_chat(client, peer_id, marks[str(peer_id)], semaphore) for peer_id in peers
+        ), return_exceptions=True)
+        for peer_id, result in zip(peers, results):
+            if isinstance(result, Exception):
+                logger.error(f"补抓群组 {peer_id} 的消息失败: {result}")
+        total = sum(result for result in results if isinstance(result, int))
+        logger.info(f"断线补抓完成：检查 {len(peers)} 个群组，补抓 {total} 条消息")
+
+    async def _backfill_chat(self, client, peer_id, min_id, semaphore) -> int:
+        """补抓单个群组min_id之后、重连后第一条实时消息之前的消息，并送入正常处理流程"""
+        for attempt in range(3):
+            # 任一群组触发FloodWait后，所有补抓请求一起暂停
+            delay = self._backfill_pause_until - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
             try:
-                # 获取消息内容
-                message = event.message
-                
-                # 记录所有收到的消息，包括消息类型
-                msg_type = "未知类型"
-                if message.text:
-                    msg_type = "文本消息"
-                elif message.media:
-                    msg_type = "媒体消息"
-                elif message.sticker:
-                    msg_type = "贴纸"
-                elif message.document:
-                    msg_type = "文档"
-                elif message.voice:
-                    msg_type = "语音消息"
-                elif message.video:
-                    msg_type = "视频"
-                elif message.video_note:
-                    msg_type = "视频笔记"
-                elif message.gif:
-                    msg_type = "GIF"
-
-                # 先记录原始消息，确保我们看到了所有消息
-                logger.info(f"消息ID: {message.id} 消息来源：{source_chat} ({group_name}) 消息类型：{msg_type} 消息内容: {message.text[:100] if message.text else '非文本消息'}{'...' if (message.text and len(message.text) > 100) else ''}")
-                
-                # 创建唯一标识符
-                config_id = f"{source_chat}_{target_chat}"
-                
-                if message.text:
-                    
-                    if not self.group_messages.get(config_id):
-                        self.group_messages[config_id] = {}
-                        self.group_messages[config_id]['messages'] = []
-                        self.group_messages[config_id]['group_name'] = group_name
-                    # 每次来新消息都储存到group_messages用于定时分析
-                    self.group_messages[config_id]['messages'].append(message.text)
-                    
-                    # 使用异步但不等待的方式进行消息分析
-                    asyncio.create_task(self._process_message(message, source_chat, target_chat, group_name, bot))
+                async with semaphore:
+                    messages = [
+                        message async for message in client.iter_messages(
+                            peer_id, min_id=min_id, reverse=True, limit=settings.backfill_max_messages
+                        )
+                    ]
+                break
+            except FloodWaitError as e:
+                logger.warning(f"补抓群组 {peer_id} 时触发FloodWait，暂停 {e.seconds} 秒")
+                self._backfill_pause_until = max(self._backfill_pause_until, time.monotonic() + e.seconds)
+        else:
+            return 0
+
+        # 同一相册的连续消息合并分发
+        album = []
+        count = 0
+        for message in messages:
+            # 实时处理器已经收到的消息不再补抓
+            ceiling = self._backfill_ceilings.get(peer_id)
+            if ceiling is not None and message.id >= ceiling:
+                break
+            count += 1
+            if message.action:
+                continue
+            if album and message.grouped_id != album[0].grouped_id:
+                await self.dispatch_album(album, backfill=True)
+                album = []
+            if message.grouped_id:
+                album.append(message)
+                continue
+            await self._dispatch_message(peer_id, message, backfill=True)
+        if album:
+            await self.dispatch_album(album, backfill=True)
+        if count:
+            logger.info(f"群组 {peer_id} 补抓 {count} 条消息（ID > {min_id}）")
+        return count
+
+    async def dispatch_edited_message(self, event):
+        """消息编辑处理器，更新缓冲中的文本，仅在改动明显时重新分析"""
+        routes = self.source_routes.get(event.chat_id)
+        message = event.message
+        if not routes or not message.text:
+            return
+        # 与dispatch_new_message相同，依赖Telethon事件的内部属性_entities
+        self.sender_cache.add_entities(getattr(event, '_entities', {}).values())
+        try:
+            # Telegram对不改动文本的编辑（如修改按钮、媒体）也会推送，文本未变时直接忽略
+            previous = self.last_texts.get((event.chat_id, message.id))
+            if previous == message.text:
+                return
+            self._remember_text(event.chat_id, message.id, message.text)
+            # 没见过原文（如启动前发送的消息）时按新消息处理
+            reanalyze = previous is None or self._is_significant_edit(previous, message.text)
+            for config_id, route in list(routes.items()):
+                self._update_buffered_text(config_id, route['group_name'], message, reanalyze)
+            if not reanalyze:
+                logger.info(f"消息ID: {message.id} 编辑改动较小，仅更新缓冲文本")
+                return
+            
+            logger.info(f"消息ID: {message.id} 编辑后内容变化明显，重新分析: {message.text[:100]}")
+            for config_id, route in list(routes.items()):
+                await self.ingest_queue.put({
+                    'message': message,
+                    'config_id': config_id,
+                    'source_chat': route['source_chat'],
+                    'target_chat': route['target_chat'],
+                    'group_name': route['group_name']
+                })
         
-            except Exception as e:
-                logger.error(f"Error forwarding message via Telethon: {e}")
-                
-        return forward_handler
-    
-    async def _process_message(self, message, source_chat, target_chat, group_name, bot=None):
+        except Exception as e:
+            logger.error(f"Error handling edited message: {e}")
+
+    def _remember_text(self, chat_id, message_id, text):
+        """记录消息的最新文本，超过上限时淘汰最久未见的消息"""
+        key = (chat_id, message_id)
+        self.last_texts[key] = text
+        self.last_texts.move_to_end(key)
+        while len(self.last_texts) > settings.edit_tracking_size:
+            self.last_texts.popitem(last=False)
+
+    @staticmethod
+    def _is_significant_edit(old_text, new_text) -> bool:
+        """编辑前后文本相似度低于阈值时认为改动明显"""
+        # 先用开销较小的上界快速判断，明显不同时无需计算完整相似度
+        matcher = difflib.SequenceMatcher(None, old_text, new_text)
+        threshold = settings.edit_similarity_threshold
+        return matcher.real_quick_ratio() < threshold or matcher.quick_ratio() < threshold or matcher.ratio() < threshold
+
+    def _update_buffered_text(self, config_id, group_name, message, significant):
+        """把编辑后的文本写回缓冲"""
+        buffer = self.group_messages.get(config_id)
+        record = buffer.by_message_id.get(message.id) if buffer else None
+        if record is None:
+            # 缓冲中没有原文（如已被定时分析取走或被淘汰），只有改动明显时才作为新消息储存
+            if not significant:
+                return
+            self.group_messages.append(
+                config_id, group_name,
+                message_id=message.id,
+                timestamp=(message.edit_date or message.date).timestamp(),
+                sender_id=message.sender_id,
+                text=message.text
+            )
+            if self.message_spool:
+                self.message_spool.append(config_id, group_name, message.id, (message.edit_date or message.date).timestamp(), message.sender_id, message.text)
+            return
+
+        if buffer.text(record) == message.text:
+            return
+        self.group_messages.replace_text(config_id, record, message.text)
+        if self.message_spool:
+            self.message_spool.replace(config_id, message.id, message.text)
+
+    async def _route_message(self, config_id, message, source_chat, target_chat, group_name, album=None, backfill=False):
+        """把一条新消息交给一个转发配置处理，config_id使用路由表中的配置ID，与定时分析和停止转发一致"""
+        if message.text:
+            # 查找近似重复消息，同一目标群组内重复的消息只储存一次
+            cluster, is_first = (None, True)
+            if settings.dedup_window_seconds > 0:
+                cluster, is_first = self.dedup_index.observe(message.text, source_chat)
+            
+            # 每次来新消息都储存到group_messages用于定时分析
+            if cluster is None or target_chat not in cluster.buffered_targets:
+                self.group_messages.append(
+                    config_id, group_name,
+                    message_id=message.id,
+                    timestamp=message.date.timestamp(),
+                    sender_id=message.sender_id,
+                    text=message.text,
+                    cluster=cluster
+                )
+                if self.message_spool:
+                    self.message_spool.append(config_id, group_name, message.id, message.date.timestamp(), message.sender_id, message.text)
+                if cluster is not None:
+                    cluster.buffered_targets.add(target_chat)
+            
+            # 放入有界队列，由worker异步分析
+            await self.ingest_queue.put({
+                'message': message,
+                'config_id': config_id,
+                'source_chat': source_chat,
+                'target_chat': target_chat,
+                'group_name': group_name,
+                'cluster': cluster,
+                'is_first': is_first,
+                'album': album,
+                'backfill': backfill
+            })
+
+    async def _classify_message(self, message):
+        """对单条消息进行预过滤和LLM分析，跳过分析时返回None"""
+        # 先用本地关键词预过滤，未命中的消息跳过LLM或进入低优先级批次
+        low_priority = False
+        if settings.prefilter_mode != 'off':
+            matched_keywords = self.prefilter.check(message.text)
+            if not matched_keywords:
+                if settings.prefilter_mode == 'skip':
+                    logger.info(f"消息ID: {message.id} 未命中预过滤关键词，跳过分析")
+                    return None
+                low_priority = True
+            if self.prefilter.checked % 500 == 0:
+                logger.info(self.prefilter.summary())
+
+        return await self.message_batcher.classify(message.text, low_priority=low_priority)
+
+    async def _process_message(self, message, source_chat, target_chat, group_name, config_id=None, bot=None, cluster=None, is_first=True, album=None, backfill=False):
         """分离消息处理逻辑，避免阻塞主事件处理器"""
         try:
             if message.text:
-                analysis = await analyze_message(message=message.text)
+                if cluster is not None and not is_first:
+                    # 近似重复消息直接复用第一份副本的分析结果
+                    analysis = await asyncio.shield(cluster.verdict)
+                    logger.info(f"消息ID: {message.id} 与已分析消息重复（{len(cluster.sources)} 个群组），复用分析结果")
+                else:
+                    analysis = None
+                    try:
+                        analysis = await self._classify_message(message)
+                    finally:
+                        # 分析失败时以None结束，避免重复消息一直等待
+                        if cluster is not None and not cluster.verdict.done():
+                            cluster.verdict.set_result(analysis)
                 logger.info(f"消息ID: {message.id}，分析结果: {analysis}")
                 
                 if not isinstance(analysis, dict) or not analysis.get('is_illegal_comment', False):
                     return
                 
+                # 同一组重复消息在每个目标群组只告警一次
+                if cluster is not None:
+                    if target_chat in cluster.alerted_targets:
+                        logger.info(f"消息ID: {message.id} 的重复消息已告警过目标群组 {target_chat}，跳过")
+                        return
+                    cluster.alerted_targets.add(target_chat)
+                
                 # 获取发送者信息
-                sender_info = "未知用户"
-                if message.sender:
-                    sender_id = message.sender.id
-                    if message.sender.username:
-                        sender_info = f"@{message.sender.username} (<a href=\"https://t.me/{message.sender.username}\">用户链接</a>)"
-                    elif message.sender.first_name:
-                        sender_name = message.sender.first_name
-                        if message.sender.last_name:
-                            sender_name += f" {message.sender.last_name}"
-                        sender_info = f"{sender_name} (<a href=\"tg://user?id={sender_id}\">用户链接</a>)"
-
-                text = f"""⚠️ 来自 \"{group_name}\" 的非法消息:
+                sender_info, _ = self.sender_cache.lookup(message)
+
+                # 告警以ParseMode.HTML发送，与汇总消息一样转义群组名、原因和原文
+                text = f"""⚠️ 来自 \"{html.escape(group_name)}\" 的非法消息{'（断线期间补抓）' if backfill else ''}:
                 \n发送者：\n{sender_info}
                 \n发送时间：\n{(message.date + timedelta(hours=8)).strftime('%Y-%m-%d %H:%M:%S')} (北京时间)
-                \n原因：\n{analysis.get('reason', '该消息表达了非法内容')}
-                \n原文：\n{message.text}"""
+                \n原因：\n{html.escape(str(analysis.get('reason', '该消息表达了非法内容')))}
+                \n原文：\n{html.escape(message.text or '')}"""
+                
+                # 同一源群组短时间内的后续告警合并到汇总消息中，不再单独发送文字和媒体
+                current_chat_id = await self.alert_aggregator.submit(
+                    target_chat, source_chat, group_name, text, message, sender_info,
+                    analysis.get('reason', '该消息表达了非法内容')
+                )
+                if current_chat_id is None:
+                    logger.info(f"消息ID: {message.id} 已合并到发往 {target_chat} 的告警汇总")
+                    return
                 
-                # 使用提供的bot或context.bot发送消息
+                # 使用提供的bot或context.bot发送媒体
                 message_bot = bot if bot else self.application.bot
-                current_chat_id = target_chat
-                try:
-                    await message_bot.send_message(
-                        chat_id=current_chat_id,
-                        text=text,
-                        parse_mode=ParseMode.HTML
-                    )
-                except telegram.error.BadRequest as e:
-                    # 检查是否是群组迁移错误
-                    if "Group migrated to supergroup" in str(e):
-                        # 提取新的超级群组ID
-                        new_id_match = re.search(r"New chat id: (-\d+)", str(e))
-                        if new_id_match:
-                            current_chat_id = new_id_match.group(1)
-                            logger.info(f"群组已迁移到超级群组。旧ID: {target_chat}, 新ID: {current_chat_id}")
-                            
-                            # 更新配置中的目标群组ID
-                            self._update_migrated_chat_id(target_chat, current_chat_id)
-                            
-                            # 使用新ID重试发送消息
-                            await message_bot.send_message(
-                                chat_id=current_chat_id,
-                                text=text,
-                                parse_mode=ParseMode.HTML
-                            )
-                        else:
-                            logger.error(f"无法从错误消息中提取新的群组ID: {e}")
-                    else:
-                        # 其他BadRequest错误
-                        logger.error(f"发送消息时出错: {e}")
-                except Exception as e:
-                    logger.error(f"发送消息时出错: {e}")
             
-                # 如果有媒体内容，也可以处理
-                if message.media:
-                    # 下载媒体文件
-                    file_path = await message.download_media("./temp/")
-                    if file_path:
-                        try:
-                            # 根据媒体类型发送，也可以添加其他类型
-                            if message.photo:
-                                with open(file_path, 'rb') as photo:
-                                    await message_bot.send_photo(
-                                        chat_id=current_chat_id,
-                                        photo=photo,
-                                        caption=f"📷 来自 \"{group_name}\" 的图片 | {message.text if message.text else ''}"
-                                    )
-                        except Exception as e:
-                            logger.error(f"Error sending media: {e}")
-                        finally:
-                            # 确保在任何情况下都尝试删除临时文件
-                            try:
-                                if os.path.exists(file_path):
-                                    os.remove(file_path)
-                            except Exception as e:
-                                logger.error(f"Error removing temporary file {file_path}: {e}")
+                # 如果有媒体内容，在内存中中转后发送，相册作为一组媒体发送
+                if album and len(album) > 1:
+                    try:
+                        await self.media_relay.relay_album(album, message_bot, current_chat_id, group_name)
+                    except Exception as e:
+                        logger.error(f"Error sending media group: {e}")
+                elif message.media:
+                    try:
+                        await self.media_relay.relay(message, message_bot, current_chat_id, group_name)
+                    except Exception as e:
+                        logger.error(f"Error sending media: {e}")
         
-                logger.info(f"Message forwarded from {source_chat} ({group_name}) to {target_chat}")
+                logger.info(f"Message forwarded from {source_chat} ({group_name}) to {target_chat} (config {config_id})")
     
         except Exception as e:
             logger.error(f"Error processing message in _process_message: {e}")
             
+    async def _send_alert(self, target_chat, text):
+        """通过持久化发送队列发送HTML告警，返回实际发送到的群组ID（群组迁移后可能变化）"""
+        current_chat_id = await self.outbox.send(
+            self.application.bot,
+            target_chat,
+            text,
+            lane=Lane.ALERT,
+            parse_mode=ParseMode.HTML
+        )
+        # 暂时发送失败的告警留在队列中按退避时间重试
+        return current_chat_id if current_chat_id is not None else target_chat
+
     def _update_migrated_chat_id(self, old_chat_id, new_chat_id):
         """更新已迁移群组的ID"""
         try:
             # 更新内存中的转发配置
             updated = False
             for config in self.forward_configs:
+                # 每个配置单独判断，避免无关配置的路由被重建
+                config_updated = False
                 # 检查源群组和目标群组
                 if str(config['source_chat']) == str(old_chat_id):
                     config['source_chat'] = new_chat_id
                     logger.info(f"已更新源群组ID: {old_chat_id} -> {new_chat_id}")
-                    updated = True
+                    config_updated = True
                 
                 if str(config['target_chat']) == str(old_chat_id):
                     config['target_chat'] = new_chat_id
                     logger.info(f"已更新目标群组ID: {old_chat_id} -> {new_chat_id}")
-                    updated = True
+                    config_updated = True
                 
                 # 更新配置ID
-                if updated:
+                if config_updated:
+                    updated = True
                     old_id = config['id']
                     config['id'] = f"{config['source_chat']}_{config['target_chat']}"
                     logger.info(f"已更新配置ID: {old_id} -> {config['id']}")
                     
-                    # 更新消息处理器字典中的键
-                    if old_id in self.message_handlers:
-                        self.message_handlers[config['id']] = self.message_handlers.pop(old_id)
+                    # 缓冲的消息及其磁盘日志随配置ID迁移
+                    self.group_messages.rename(old_id, config['id'])
+                    if self.message_spool:
+                        self.message_spool.rename(old_id, config['id'])
+                    
+                    # 原地更新路由表中的配置
+                    if old_id in self.config_routes:
+                        self.remove_forward_route(old_id)
+                        task = asyncio.create_task(self.add_forward_route(
+                            client=self.telethon_client,
+                            source_chat=config['source_chat'],
+                            target_chat=config['target_chat'],
+                            group_name=config['group_name'],
+                            config_id=config['id']
+                        ))
+                        self._route_tasks.add(task)
+                        task.add_done_callback(self._route_tasks.discard)
+            
+            # 目标群组迁移后，定时分析任务改用新ID
+            for job_target in list(self.scheduled_jobs):
+                if str(job_target) == str(old_chat_id):
+                    job = self.scheduled_jobs.pop(job_target)
+                    job.data['target_chat'] = new_chat_id
+                    self.scheduled_jobs[new_chat_id] = job
             
             # 如果有更新，保存到文件
             if updated:
                 self.save_forward_configs()
                 logger.info("已保存更新后的转发配置")
                 
-                # 重新初始化消息处理器
-                asyncio.create_task(self.restore_message_handlers())
-                
         except Exception as e:
             logger.error(f"更新迁移群组ID时出错: {e}")
 
@@ -880,8 +1252,8 @@ class TelegramBotService:
                     await update.message.reply_text(f'❌ 无法获取群组信息: {str(e)}')
                     return
             
-            # 使用通用方法创建消息处理器
-            forward_handler = self.create_forward_handler(
+            # 加入转发路由表
+            await self.add_forward_route(
                 client=client,
                 source_chat=source_chat,
                 target_chat=target_chat,
@@ -909,7 +1281,6 @@ class TelegramBotService:
                 self.forward_configs.append(config)
                 # 在成功设置转发后，保存配置
                 self.save_forward_configs()
-            self.message_handlers[config_id] = forward_handler
 
             if not target_chat in self.scheduled_jobs:
                 # 创建定时任务
@@ -935,13 +1306,24 @@ class TelegramBotService:
         if not context.args or len(context.args) < 1:
             await update.message.reply_text(
                 '请提供源群组ID/用户名/邀请链接和查询句：\n'
-                '/get_history [源群组ID/用户名/邀请链接] [查询句]\n\n'
+                '/get_history [源群组ID/用户名/邀请链接] [选项] [查询句]\n\n'
+                '可选项：\n'
+                f'limit=条数（默认{settings.history_default_limit}，最多{settings.history_max_limit}）\n'
+                'since=2025-01-01 until=2025-01-31（北京时间日期范围）\n'
+                'mode=forward（直接转发原消息）或 mode=digest（合并为摘要页，默认）\n\n'
                 '例如：\n'
                 '/get_history @groupname 这个群组内有哪些关于足球的消息\n'
+                '/get_history @groupname limit=2000 since=2025-01-01 mode=forward 最近的讨论\n'
                 '/get_history https://t.me/joinchat/abcdef... 查询最近的讨论\n'
             )
             return
             
+        try:
+            options, query_words = self._parse_history_options(context.args[1:])
+        except ValueError as e:
+            await update.message.reply_text(f'❌ {e}')
+            return
+            
         try:
             # 初始化Telethon客户端
             client = await self.initialize_telethon_client()
@@ -951,7 +1333,7 @@ class TelegramBotService:
                 
             # 获取源群组和用户查询句
             source_input = context.args[0]
-            query = ' '.join(context.args[1:]) if len(context.args) > 1 else "所有消息"
+            query = ' '.join(query_words) if query_words else "所有消息"
             
             # 获取目标群组ID（当前聊天ID）
             target_chat = update.effective_chat.id
@@ -1063,64 +1445,43 @@ class TelegramBotService:
                     await update.message.reply_text(f'❌ 无法获取群组信息: {str(e)}')
                     return
             
-            # 获取消息数量
-            limit = 50  # 默认获取50条
-            
             await update.message.reply_text(f'🔍 正在获取 "{group_name}" 的历史消息...')
             
-            # 获取历史消息
-            messages = await client.get_messages(source_chat, limit=limit)
+            # 获取历史消息，按时间范围过滤，再按时间顺序（从旧到新）排列
+            messages = []
+            async for message in client.iter_messages(source_chat, limit=options['limit'], offset_date=options['until']):
+                if options['since'] and message.date < options['since']:
+                    break
+                messages.append(message)
+            messages.reverse()
             
             if not messages:
-                await update.message.reply_text('⚠️ 未找到历史消息，可能是因为群组为空或您没有足够的权限')
+                await update.message.reply_text('⚠️ 未找到历史消息，可能是因为群组为空、时间范围内没有消息或您没有足够的权限')
                 return
                 
             await update.message.reply_text(f'✅ 找到 {len(messages)} 条历史消息')
             
-            # 按时间顺序转发消息（从旧到新）
-            for message in reversed(messages):
-                if message.text:
-                    # 获取发送者信息，处理可能的None情况
-                    sender_info = "未知用户"
-                    if message.sender:
-                        if message.sender.username:
-                            sender_info = f"@{message.sender.username}"
-                        elif message.sender.first_name:
-                            sender_name = message.sender.first_name
-                            if message.sender.last_name:
-                                sender_name += f" {message.sender.last_name}"
-                            sender_info = sender_name
-                    
-                    text = f"📜 来自 \"{group_name}\" 的历史消息:\n发送者：{sender_info}\n发送时间：\n{message.date.strftime('%Y-%m-%d %H:%M:%S')}\n内容：\n{message.text}"
-                    await context.bot.send_message(
-                        chat_id=target_chat,
-                        text=text
-                    )
-                    await asyncio.sleep(1.3)  # 避免发送过快
-                
-                # # 如果有媒体内容，也可以处理
-                # if message.media:
-                #     # 下载媒体文件
-                #     file_path = await message.download_media("./temp/")
-                #     if file_path:
-                #         try:
-                #             # 根据媒体类型发送，也可以添加其他类型
-                #             if message.photo:
-                #                 with open(file_path, 'rb') as photo:
-                #                     await context.bot.send_photo(
-                #                         chat_id=target_chat,
-                #                         photo=photo,
-                #                         caption=f"📷 来自 \"{group_name}\" 的历史图片 | {message.text if message.text else ''}"
-                #                     )
-                #         except Exception as e:
-                #             logger.error(f"Error sending media: {e}")
-                #         finally:
-                #             # 确保在任何情况下都尝试删除临时文件
-                #             try:
-                #                 if os.path.exists(file_path):
-                #                     os.remove(file_path)
-                #             except Exception as e:
-                #                 logger.error(f"Error removing temporary file {file_path}: {e}")
+            remaining = messages
+            if options['mode'] == 'forward':
+                # 用户账号转发到私聊ID时会发到收藏夹或与该用户的私聊，只允许转发到群组和频道
+                if update.effective_chat.type not in (ChatType.GROUP, ChatType.SUPERGROUP, ChatType.CHANNEL):
+                    await update.message.reply_text('ℹ️ 直接转发只支持群组和频道，私聊中改为发送消息摘要')
+                else:
+                    forwarded, error = await self._forward_history(client, source_chat, target_chat, messages)
+                    remaining = messages[forwarded:]
+                    if error is not None:
+                        logger.warning(f"服务端转发历史消息失败（已转发 {forwarded} 条），剩余消息改为发送摘要: {error}")
+                        await update.message.reply_text(
+                            f'⚠️ 已直接转发 {forwarded} 条，其余 {len(remaining)} 条无法转发（{str(error)}），改为发送消息摘要'
+                        )
+            if remaining:
+                # 历史消息合并为摘要页发送，消息过多时发送文件
+                lines = []
+                for message in remaining:
+                    if message.text:
+                        _, sender_info = self.sender_cache.lookup(message)
+                        lines.append(f"[{message.date.strftime('%Y-%m-%d %H:%M:%S')}] {sender_info}：\n{message.text}")
+                await send_items(context.bot, target_chat, lines, header=f'📜 来自 "{group_name}" 的历史消息（{len(lines)} 条）', lane=Lane.BULK)
             
             await update.message.reply_text('✅ 历史消息转发完成，正在进行分析')
             logger.info(f"Historical messages forwarded from {source_chat} ({group_name}) to {target_chat}")
@@ -1128,14 +1489,15 @@ class TelegramBotService:
             message_text = '\n'.join(message.text for message in messages if message.text)
 
             try:
-                analysis = analyze_content(
+                await self.send_streaming_reply(
+                        context.bot,
+                        target_chat,
+                        analyze_content_stream(
                             message_text,
                             query,
-                            task_type="电报群组用户发言"
+                            task_type="电报群组用户发言",
+                            chat_key=target_chat
                         )
-                await context.bot.send_message(
-                        chat_id=target_chat,
-                        text=analysis
                     )
             except Exception as e:
                 logger.error(f"Error analyzing historical messages: {e}")
@@ -1145,6 +1507,51 @@ class TelegramBotService:
             logger.error(f"Error getting historical messages: {e}")
             await update.message.reply_text(f'❌ 获取历史消息时出错: {str(e)}')
 
+    @staticmethod
+    def _parse_history_options(args):
+        """解析get_history的 limit/since/until/mode 选项，返回选项和剩余的查询词"""
+        options = {'limit': settings.history_default_limit, 'since': None, 'until': None, 'mode': 'digest'}
+        query_words = []
+        for arg in args:
+            key, sep, value = arg.partition('=')
+            if not sep or key not in options:
+                query_words.append(arg)
+                continue
+            if key == 'limit':
+                if not value.isdigit() or int(value) < 1:
+                    raise ValueError('limit 需要是正整数，例如 limit=500')
+                options['limit'] = min(int(value), settings.history_max_limit)
+            elif key == 'mode':
+                if value not in ('forward', 'digest'):
+                    raise ValueError('mode 只能是 forward 或 digest')
+                options['mode'] = value
+            else:
+                try:
+                    # 日期按北京时间解析，转换为UTC与消息时间比较
+                    day = datetime.strptime(value, '%Y-%m-%d').replace(tzinfo=timezone.utc) - timedelta(hours=8)
+                except ValueError:
+                    raise ValueError(f'{key} 的日期格式应为 YYYY-MM-DD')
+                # until 包含当天
+                options[key] = day + timedelta(days=1) if key == 'until' else day
+        return options, query_words
+
+    async def _forward_history(self, client, source_chat, target_chat, messages):
+        """用Telethon在服务端批量转发原消息，每次请求最多100条，返回(已转发条数, 失败时的异常)"""
+        ids = [message.id for message in messages]
+        batch_size = 100
+        for start in range(0, len(ids), batch_size):
+            batch = ids[start:start + batch_size]
+            while True:
+                try:
+                    await client.forward_messages(target_chat, batch, from_peer=source_chat)
+                    break
+                except FloodWaitError as e:
+                    logger.warning(f"转发历史消息触发限流，等待 {e.seconds} 秒")
+                    await asyncio.sleep(e.seconds)
+                except Exception as e:
+                    return start, e
+        return len(ids), None
+
     async def list_forwards(self, update: Update, context: CallbackContext) -> None:
         """列出当前正在监听的群组"""
         if not self.forward_configs:
@@ -1166,8 +1573,8 @@ class TelegramBotService:
             group_name = config['group_name']
             config_id = config['id']
             
-            # 检查处理器是否存在
-            handler_status = "✅ 正常" if config_id in self.message_handlers else "❌ 未注册"
+            # 检查路由是否存在
+            handler_status = "✅ 正常" if config_id in self.config_routes else "❌ 未注册"
             
             message += f"{i}. 来源：{group_name}\n   ID：{source_chat}\n   状态：{handler_status}\n\n"
         
@@ -1204,10 +1611,8 @@ class TelegramBotService:
             for config in configs_to_remove:
                 config_id = config['id']
                 target_chat = config['target_chat']
-                if config_id in self.message_handlers:
-                    # 移除消息处理器
-                    self.telethon_client.remove_event_handler(self.message_handlers[config_id])
-                    del self.message_handlers[config_id]
+                # 移除转发路由
+                self.remove_forward_route(config_id)
                 
                 # 移除定时任务
                 if target_chat in self.scheduled_jobs:
@@ -1215,13 +1620,12 @@ class TelegramBotService:
                     del self.scheduled_jobs[target_chat]
                     logger.info(f"Removed scheduled message analysis for {config['group_name']}")
                 
-                # 从配置列表中移除
+                # 从配置列表中移除并删除消息记录
                 self.forward_configs.remove(config)
+                self._drop_buffered_messages(config_id)
 
             # 保存配置
             self.save_forward_configs()
-            # 删除消息记录
-            self.group_messages = {}
             await update.message.reply_text(f'✅ 已停止所有群组的消息转发（共 {len(configs_to_remove)} 个）')
             logger.info(f"Stopped all {len(configs_to_remove)} message forwardings for chat {target_chat}")
             return
@@ -1246,15 +1650,12 @@ class TelegramBotService:
                 await update.message.reply_text(f'❌ 未找到ID或名称为 "{source_input}" 的监听配置')
                 return
             
-            # 移除消息处理器
+            # 移除转发路由
             config_id = config_to_remove['id']
-            if config_id in self.message_handlers:
-                self.telethon_client.remove_event_handler(self.message_handlers[config_id])
-                del self.message_handlers[config_id]
+            self.remove_forward_route(config_id)
             
             # 移除消息记录
-            if config_id in self.group_messages:
-                del self.group_messages[config_id]
+            self._drop_buffered_messages(config_id)
             
             # 从配置列表中移除
             self.forward_configs.remove(config_to_remove)
@@ -1275,8 +1676,35 @@ class TelegramBotService:
             logger.error(f"Error stopping message forwarding: {e}")
             await update.message.reply_text(f'❌ 停止消息转发时出错: {str(e)}')
     
+    def _drop_buffered_messages(self, config_id):
+        """删除转发配置的缓冲消息及其磁盘日志"""
+        self.group_messages.remove(config_id)
+        if self.message_spool:
+            self.message_spool.mark_drained(config_id)
+
+    def restore_buffered_messages(self):
+        """从磁盘日志恢复上次运行中尚未分析的缓冲消息"""
+        if not self.message_spool:
+            return
+        config_ids = {config['id'] for config in self.forward_configs}
+        for config_id, records in self.message_spool.replay().items():
+            if config_id not in config_ids:
+                self.message_spool.mark_drained(config_id)
+                continue
+            for record in records:
+                self.group_messages.append(
+                    config_id, record['g'],
+                    message_id=record['i'],
+                    timestamp=record['ts'],
+                    sender_id=record['s'],
+                    text=record['x']
+                )
+
     async def post_init_callback(self, application: Application) -> None:
         """在应用程序初始化后调用"""
+        # 继续发送上次运行未送达的消息
+        self.outbox.start(application.bot)
+        self.restore_buffered_messages()
         if self.forward_configs:
             logger.info(f"应用程序已初始化，开始恢复消息处理器...")
             await self.restore_message_handlers()
@@ -1296,11 +1724,8 @@ class TelegramBotService:
                 if target_chat in self.scheduled_jobs:
                     continue
                 
-                # 确保群组消息字典已初始化
-                if config_id not in self.group_messages:
-                    self.group_messages[config_id] = {}
-                    self.group_messages[config_id]['messages'] = []
-                    self.group_messages[config_id]['group_name'] = group_name
+                # 确保群组消息缓冲已初始化
+                self.group_messages.group(config_id, group_name)
                     
                 new_job = application.job_queue.run_repeating(
                     callback=self.send_scheduled_message_analysis,
@@ -1321,19 +1746,27 @@ class TelegramBotService:
         target_chat = job_data.get('target_chat')
   
         messages = {} # {sc: {group_name: str, messages: [str]}}
-        for config_id in self.group_messages:
-            sc = config_id.split('_')[0]
-            tc = config_id.split('_')[1]
-            if str(tc) == str(target_chat):
-                gn = self.group_messages[config_id]['group_name']
+        duplicate_count = 0
+        # 已取出的缓冲：(配置ID, 快照, 消息日志检查点)，报告交给发送队列后才在日志中标记取走
+        drained = []
+        for config_id, source_chat in list(self.target_index.get(str(target_chat), {}).items()):
+            sc = str(source_chat)
+            if config_id in self.group_messages:
+                # 取出并清空对应消息缓冲
+                snapshot = self.group_messages.drain(config_id)
+                drained.append((config_id, snapshot, self.message_spool.checkpoint() if self.message_spool else None))
                 if not messages.get(sc, None):
                     logger.info(f"初始化消息列表")
                     messages[sc] = {}
                     messages[sc]['messages'] = []
-                    messages[sc]['group_name'] = gn
-                messages[sc]['messages'].extend(self.group_messages[config_id]['messages'])
-                # 清空对应消息列表
-                self.group_messages[config_id]['messages'] = []
+                    messages[sc]['group_name'] = snapshot.group_name
+                for record, text in snapshot:
+                    # 跨群组重复的消息标注出现的群组数
+                    cluster = record.cluster
+                    if cluster is not None and len(cluster.sources) > 1:
+                        text = f"{text} [×{len(cluster.sources)} 群组]"
+                        duplicate_count += len(cluster.sources) - 1
+                    messages[sc]['messages'].append(text)
         
         # 获取当前UTC时间并转换为北京时间
         current_time_utc = datetime.now()
@@ -1342,22 +1775,49 @@ class TelegramBotService:
         message_length = len([item for sc in messages for item in messages[sc]['messages']])
         logger.info(f"开始分析半小时内的消息，消息：{messages} 消息长度：{message_length}")
         if message_length == 0:
-            await context.bot.send_message(
-                chat_id=target_chat,
+            await self.outbox.send(
+                context.bot,
+                target_chat,
+                lane=Lane.REPORT,
                 text=f"⏰ 半小时消息分析\n\n时间：{beijing_time.strftime('%Y-%m-%d %H:%M:%S')} (北京时间)\n\n最近半小时未收到任何消息，跳过分析"
             )
+            self._mark_reported(drained)
             return
         
         try:
-            analysis = (await analyze_scheduled_messages(messages.values())).replace("```", "").replace("plaintext", "") # messages.values(): [{group_name: str, messages: [str]}]
+            analysis = (await analyze_scheduled_messages(messages.values(), chat_key=target_chat)).replace("```", "").replace("plaintext", "") # messages.values(): [{group_name: str, messages: [str]}]
             
-            await context.bot.send_message(
-                chat_id=target_chat,
-                text=f'⏰ 半小时消息分析\n\n时间：{beijing_time.strftime('%Y-%m-%d %H:%M:%S')} (北京时间)\n\n消息数量：{message_length}\n\n' + analysis
+            await self.outbox.send(
+                context.bot,
+                target_chat,
+                lane=Lane.REPORT,
+                text=f'⏰ 半小时消息分析\n\n时间：{beijing_time.strftime("%Y-%m-%d %H:%M:%S")} (北京时间)\n\n消息数量：{message_length}\n\n'
+                     + (f'跨群组重复消息：{duplicate_count} 条（已合并）\n\n' if duplicate_count else '')
+                     + analysis
             )
+            # 报告已写入发送队列，消息日志中的这批消息可以标记为已取走
+            self._mark_reported(drained)
             logger.info(f"分析完成，发送报告到 {target_chat}")
+            logger.info(OpenAIService().cache.summary())
+            logger.info(self.prefilter.summary())
+            logger.info(OpenAIService().scheduler.summary())
+            logger.info(self.ingest_queue.summary())
+            logger.info(self.group_messages.summary())
+            logger.info(get_send_dispatcher(context.bot).summary())
+            logger.info(self.alert_aggregator.summary())
+            logger.info(self.outbox.summary())
         except Exception as e:
-            logger.error(f"Error analyzing scheduled messages: {e}")            
+            logger.error(f"Error analyzing scheduled messages: {e}")
+            # 分析失败时把取出的消息放回缓冲，下次定时分析一并处理
+            for config_id, snapshot, _ in drained:
+                self.group_messages.restore(config_id, snapshot)
+
+    def _mark_reported(self, drained):
+        """在消息日志中标记已生成报告的缓冲消息，只覆盖取出时检查点之前的记录"""
+        if not self.message_spool:
+            return
+        for config_id, _, checkpoint in drained:
+            self.message_spool.mark_drained(config_id, checkpoint)
             
     
     def run(self, shutdown_event=None):
@@ -1387,8 +1847,8 @@ class TelegramBotService:
                 # 启动时恢复所有已保存的转发配置的消息处理器
                 if self.forward_configs:
                     logger.info(f"正在准备恢复 {len(self.forward_configs)} 个已保存的转发配置...")
-                    # 使用post_init钩子在应用程序初始化后恢复消息处理器并添加定时消息分析任务
-                    application.post_init = self.post_init_callback
+                # 使用post_init钩子在应用程序初始化后恢复发送队列、消息处理器并添加定时消息分析任务
+                application.post_init = self.post_init_callback
             
             logger.info(f"Starting {self.bot_type.upper()} Telegram bot...")
             
@@ -1,12 +1,14 @@
 import json
 import re
+import threading
+import time
 from typing import List, Dict, Optional
 from datetime import datetime
-from openai import OpenAI
 import requests
 from smolagents import CodeAgent, OpenAIServerModel, tool
 from config.settings import settings
 from utils.utils import OpenAIService
+from utils.llm_scheduler import estimate_tokens, get_model_buckets
 from config.prompt import get_news_prompt
 
 logger = settings.get_logger(__name__)
@@ -18,7 +20,8 @@ class NewsService:
     """Service class for news-related operations."""
     openai_service = OpenAIService()
     def __init__(self):
-
+        # CodeAgent会在多次run之间保存状态，同一时间只允许一个任务使用
+        self._agent_lock = threading.Lock()
         self.setup_tools()
         
     @staticmethod
@@ -33,15 +36,30 @@ class NewsService:
         Returns:
             The response from the LLM.
         """
-        client = OpenAI(
-            api_key=settings.openai_api_key,
-            base_url=settings.openai_base_url
-        )
-        response = client.chat.completions.create(
-            model="gemini-2.0-flash-001",
-            messages=[{"role": "user", "content": prompt}],
-        )
-        return response.choices[0].message.content
+        return NewsService.routed_chat(prompt, 'news_summarize')
+
+    @staticmethod
+    def routed_chat(prompt: str, route: str) -> str:
+        """Send ``prompt`` to the model of ``route``, hedging to its fallback if the primary is slow.
+
+        The tools run in the agent's worker thread, outside the LLM scheduler,
+        so each call still reserves from the model's request and token buckets
+        and settles the token estimate with the reported usage afterwards.
+        """
+        def call(model: str) -> str:
+            buckets = get_model_buckets(model)
+            estimated_tokens = estimate_tokens(prompt)
+            delay = max(buckets['requests'].reserve(1), buckets['tokens'].reserve(estimated_tokens))
+            if delay > 0:
+                time.sleep(delay)
+            response = NewsService.openai_service.client.chat.completions.create(
+                model=model,
+                messages=[{"role": "user", "content": prompt}],
+            )
+            if response.usage:
+                buckets['tokens'].refund(estimated_tokens - response.usage.total_tokens)
+            return response.choices[0].message.content
+        return NewsService.openai_service.router.run_sync(route, call)
     
     @staticmethod
     @tool
@@ -55,9 +73,10 @@ class NewsService:
         Returns:
             The translated text.
         """
-        return NewsService.llm_chat(
-        f"Translate the following text to Chinese: {text} Output the translation directly."
-    )
+        return NewsService.routed_chat(
+            f"Translate the following text to Chinese: {text} Output the translation directly.",
+            'news_translate'
+        )
 
     @staticmethod
     @tool
@@ -71,8 +90,9 @@ class NewsService:
         Returns:
             The summarized text.
         """
-        return NewsService.llm_chat(
-            f"Summarize the following text in Chinese: {text} Output the summary directly. The summary should be concise and only include the most important information."
+        return NewsService.routed_chat(
+            f"Summarize the following text in Chinese: {text} Output the summary directly. The summary should be concise and only include the most important information.",
+            'news_summarize'
         )
 
     @tool
@@ -106,7 +126,8 @@ class NewsService:
             raise
     
     def get_news(self, topic: str, date: str):
-        return self.agent.run(task=get_news_prompt.replace('{sourceUris}', str(settings.sourceUris)).replace('{topic}', topic).replace('{date}', date))
+        with self._agent_lock:
+            return self.agent.run(task=get_news_prompt.replace('{sourceUris}', str(settings.sourceUris)).replace('{topic}', topic).replace('{date}', date))
 
     def setup_tools(self):
         """Setup CodeAgent with necessary tools."""
@@ -0,0 +1,50 @@
+import asyncio
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from config.settings import settings
+
+logger = settings.get_logger(__name__)
+
+
+class AlbumCollector:
+    """Coalesces the items of a media album into one unit.
+
+    Telegram delivers every item of an album as its own message sharing a
+    ``grouped_id``. ``add`` holds such messages back until no new item of the
+    album has arrived for ``window`` seconds, then awaits ``on_album`` once with
+    all items in message ID order.
+    """
+
+    def __init__(self, on_album: Callable[[List], Awaitable], window: float = None):
+        self._on_album = on_album
+        self.window = settings.album_window_seconds if window is None else window
+        self._albums: Dict[Tuple[int, int], List] = {}
+        self._handles: Dict[Tuple[int, int], asyncio.TimerHandle] = {}
+        # 保存处理任务引用，避免任务在执行中被垃圾回收
+        self._tasks = set()
+
+    def add(self, message) -> bool:
+        """Hold ``message`` back if it belongs to an album; returns False for standalone messages."""
+        if not message.grouped_id or self.window <= 0:
+            return False
+        key = (message.chat_id, message.grouped_id)
+        self._albums.setdefault(key, []).append(message)
+        handle: Optional[asyncio.TimerHandle] = self._handles.get(key)
+        if handle is not None:
+            handle.cancel()
+        self._handles[key] = asyncio.get_running_loop().call_later(self.window, self._flush, key)
+        return True
+
+    def _flush(self, key):
+        self._handles.pop(key, None)
+        messages = sorted(self._albums.pop(key, []), key=lambda message: message.id)
+        if not messages:
+            return
+        task = asyncio.create_task(self._run(messages))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, messages):
+        try:
+            await self._on_album(messages)
+        except Exception as e:
+            logger.error(f"处理相册消息时出错: {e}")
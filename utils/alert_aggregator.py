@@ -0,0 +1,102 @@
+import asyncio
+import html
+from datetime import timedelta
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from config.settings import settings
+
+logger = settings.get_logger(__name__)
+
+# 汇总中每条原文摘录的最大长度
+EXCERPT_LENGTH = 120
+
+
+class _AlertWindow:
+    __slots__ = ('group_name', 'pending', 'handle')
+
+    def __init__(self, group_name: str):
+        self.group_name = group_name
+        self.pending: List[Tuple[str, str, str, str]] = []
+        self.handle: Optional[asyncio.TimerHandle] = None
+
+
+class AlertAggregator:
+    """Folds bursts of alerts from one source into periodic digest messages.
+
+    The first alert for a ``(target, source)`` pair is sent at once and opens
+    a window of ``window`` seconds. Alerts arriving while the window is open
+    are collected, and when it closes they go out as one digest listing the
+    sender, time and reason of each, after which the window reopens. A window
+    that closes with nothing collected ends the burst, so the next alert from
+    that source is again sent immediately.
+    """
+
+    def __init__(self, send: Callable[[object, str], Awaitable], window: float = None):
+        # send(target_chat, html_text) 返回实际发送到的群组ID（群组迁移后可能变化）
+        self._send = send
+        self.window = settings.alert_digest_window if window is None else window
+        self._windows: Dict[Tuple[str, str], _AlertWindow] = {}
+        # 保存汇总任务引用，避免任务在执行中被垃圾回收
+        self._tasks = set()
+        self.stats = {'immediate': 0, 'folded': 0, 'digests': 0}
+
+    async def submit(self, target_chat, source_chat, group_name: str, text: str, message, sender_info: str, reason: str):
+        """Send ``text`` now, or fold the alert into the open window's digest.
+
+        Returns the chat ID the alert was sent to, or None if it was folded.
+        """
+        key = (str(target_chat), str(source_chat))
+        window = self._windows.get(key)
+        if window is not None:
+            window.group_name = group_name
+            window.pending.append((
+                (message.date + timedelta(hours=8)).strftime('%H:%M:%S'),
+                sender_info,
+                reason,
+                (message.text or '')[:EXCERPT_LENGTH]
+            ))
+            self.stats['folded'] += 1
+            return None
+        if self.window > 0:
+            window = _AlertWindow(group_name)
+            self._windows[key] = window
+            window.handle = asyncio.get_running_loop().call_later(self.window, self._close, key, target_chat)
+        self.stats['immediate'] += 1
+        return await self._send(target_chat, text)
+
+    def _close(self, key, target_chat):
+        window = self._windows.get(key)
+        if window is None:
+            return
+        if not window.pending:
+            del self._windows[key]
+            return
+        text = self.render_digest(window.group_name, window.pending)
+        window.pending = []
+        # 发送汇总后窗口继续开放，持续刷屏时每个窗口最多一条汇总
+        window.handle = asyncio.get_running_loop().call_later(self.window, self._close, key, target_chat)
+        task = asyncio.create_task(self._send_digest(target_chat, text))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _send_digest(self, target_chat, text: str):
+        try:
+            await self._send(target_chat, text)
+            self.stats['digests'] += 1
+        except Exception as e:
+            logger.error(f"发送告警汇总时出错: {e}")
+
+    @staticmethod
+    def render_digest(group_name: str, pending) -> str:
+        lines = [f"⚠️ 来自 \"{html.escape(group_name)}\" 的非法消息汇总（{len(pending)} 条）:"]
+        for index, (sent_at, sender_info, reason, excerpt) in enumerate(pending, 1):
+            lines.append(
+                f"\n{index}. {sent_at} (北京时间) {sender_info}"
+                f"\n原因：{html.escape(reason)}"
+                f"\n原文：{html.escape(excerpt)}"
+            )
+        return '\n'.join(lines)
+
+    def summary(self) -> str:
+        """Return a one-line report of immediate, folded and digest alerts."""
+        return (f"告警汇总：立即发送 {self.stats['immediate']} 条，合并 {self.stats['folded']} 条，"
+                f"汇总消息 {self.stats['digests']} 条，进行中窗口 {len(self._windows)} 个")
@@ -0,0 +1,107 @@
+import asyncio
+import hashlib
+import re
+import time
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+from config.settings import settings
+
+logger = settings.get_logger(__name__)
+
+_BANDS = 4
+_BAND_BITS = 64 // _BANDS
+_BAND_MASK = (1 << _BAND_BITS) - 1
+_NOISE_PATTERN = re.compile(r'https?://\S+|[\s\W_]+', re.UNICODE)
+
+
+def simhash(text: str, shingle_size: int = 3) -> int:
+    """Return the 64-bit SimHash of ``text`` over character shingles.
+
+    Character shingles are used instead of words because Chinese text has no
+    word separators.
+    """
+    weights = [0] * 64
+    shingles = [text[i:i + shingle_size] for i in range(max(len(text) - shingle_size + 1, 1))]
+    for shingle in shingles:
+        value = int.from_bytes(hashlib.blake2b(shingle.encode('utf-8'), digest_size=8).digest(), 'big')
+        for bit in range(64):
+            weights[bit] += 1 if value >> bit & 1 else -1
+    fingerprint = 0
+    for bit, weight in enumerate(weights):
+        if weight > 0:
+            fingerprint |= 1 << bit
+    return fingerprint
+
+
+class DuplicateCluster:
+    """One piece of text and every near-identical copy of it seen in the window."""
+    __slots__ = ('fingerprint', 'first_seen', 'sources', 'verdict', 'alerted_targets', 'buffered_targets')
+
+    def __init__(self, fingerprint: int, first_seen: float):
+        self.fingerprint = fingerprint
+        self.first_seen = first_seen
+        self.sources = set()
+        # 第一份副本的分析结果，后续副本直接复用
+        self.verdict: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.alerted_targets = set()
+        self.buffered_targets = set()
+
+
+class NearDuplicateIndex:
+    """SimHash index over a sliding time window, shared by all monitored groups.
+
+    Fingerprints are split into four 16-bit bands; two texts within
+    ``max_distance`` <= 3 bits of each other always share at least one band, so a
+    lookup only compares against clusters in the matching buckets.
+    """
+
+    def __init__(self, window: float = None, max_distance: int = None, min_length: int = None):
+        self.window = settings.dedup_window_seconds if window is None else window
+        self.max_distance = settings.dedup_max_distance if max_distance is None else max_distance
+        self.min_length = settings.dedup_min_length if min_length is None else min_length
+        self._buckets: Dict[Tuple[int, int], List[DuplicateCluster]] = {}
+        self._clusters = deque()
+        self.duplicates = 0
+
+    @staticmethod
+    def _bands(fingerprint: int):
+        return [(band, fingerprint >> (band * _BAND_BITS) & _BAND_MASK) for band in range(_BANDS)]
+
+    def _expire(self, now: float):
+        while self._clusters and self._clusters[0].first_seen < now - self.window:
+            cluster = self._clusters.popleft()
+            for key in self._bands(cluster.fingerprint):
+                bucket = self._buckets.get(key)
+                if bucket:
+                    bucket.remove(cluster)
+                    if not bucket:
+                        del self._buckets[key]
+
+    def observe(self, text: str, source_chat) -> Tuple[Optional[DuplicateCluster], bool]:
+        """Record ``text`` from ``source_chat``.
+
+        Returns ``(cluster, is_first)``. ``cluster`` is None when the text is too
+        short to fingerprint reliably; ``is_first`` is True when this copy opened
+        a new cluster and is therefore responsible for classifying it.
+        """
+        normalized = _NOISE_PATTERN.sub('', text or '').lower()
+        if len(normalized) < self.min_length:
+            return None, True
+
+        now = time.monotonic()
+        self._expire(now)
+        fingerprint = simhash(normalized)
+
+        for key in self._bands(fingerprint):
+            for cluster in self._buckets.get(key, ()):
+                if bin(cluster.fingerprint ^ fingerprint).count('1') <= self.max_distance:
+                    cluster.sources.add(str(source_chat))
+                    self.duplicates += 1
+                    return cluster, False
+
+        cluster = DuplicateCluster(fingerprint, now)
+        cluster.sources.add(str(source_chat))
+        self._clusters.append(cluster)
+        for key in self._bands(fingerprint):
+            self._buckets.setdefault(key, []).append(cluster)
+        return cluster, True
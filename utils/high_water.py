@@ -0,0 +1,63 @@
+import asyncio
+import json
+import os
+from typing import Dict, Optional
+from config.settings import settings
+
+logger = settings.get_logger(__name__)
+
+
+class HighWaterMarks:
+    """Last seen message ID of every monitored chat, persisted to a JSON file.
+
+    ``observe`` is called for every incoming message and only marks the table
+    dirty; the file is rewritten at most every ``save_interval`` seconds.
+    """
+
+    def __init__(self, path: str = None, save_interval: float = 5.0):
+        self.path = path or settings.high_water_path
+        self.save_interval = save_interval
+        self._marks: Dict[str, int] = {}
+        self._save_handle: Optional[asyncio.TimerHandle] = None
+        self.load()
+
+    def load(self):
+        try:
+            if os.path.exists(self.path):
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    self._marks = {str(chat_id): int(message_id) for chat_id, message_id in json.load(f).items()}
+        except Exception as e:
+            logger.error(f"加载消息位置记录失败: {e}")
+            self._marks = {}
+
+    def get(self, chat_id) -> Optional[int]:
+        return self._marks.get(str(chat_id))
+
+    def snapshot(self) -> Dict[str, int]:
+        """Copy the current marks, e.g. before reconnecting so live updates cannot move them past a gap."""
+        return dict(self._marks)
+
+    def observe(self, chat_id, message_id: int):
+        """Advance the mark of ``chat_id`` to ``message_id`` if it is newer."""
+        key = str(chat_id)
+        if message_id <= self._marks.get(key, 0):
+            return
+        self._marks[key] = message_id
+        if self._save_handle is None:
+            try:
+                self._save_handle = asyncio.get_running_loop().call_later(self.save_interval, self.save)
+            except RuntimeError:
+                self.save()
+
+    def save(self):
+        if self._save_handle is not None:
+            self._save_handle.cancel()
+            self._save_handle = None
+        try:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            temp_path = f"{self.path}.tmp"
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(self._marks, f)
+            os.replace(temp_path, self.path)
+        except Exception as e:
+            logger.error(f"保存消息位置记录失败: {e}")
@@ -0,0 +1,165 @@
+import asyncio
+import json
+import os
+import time
+from typing import Any, Awaitable, Callable, List, Optional
+from config.settings import settings
+
+logger = settings.get_logger(__name__)
+
+OVERFLOW_POLICIES = ('block', 'drop_oldest', 'spill')
+
+
+class IngestQueue:
+    """Bounded queue and worker pool between the Telethon handler and message processing.
+
+    ``put`` enqueues a job; ``workers`` tasks take jobs off the queue and await
+    ``handler(job)``, so at most ``workers`` messages are processed at once and
+    at most ``maxsize`` wait in memory. When the queue is full, ``policy`` decides
+    what happens to a new job:
+
+    - ``block``: ``put`` waits for a free slot, pushing back on the producer.
+    - ``drop_oldest``: the oldest queued job is discarded to make room.
+    - ``spill``: the job is written to a JSONL file through ``serialize`` and read
+      back through ``restore`` once the queue has drained below half.
+
+    Jobs that are dropped or spilled are passed to ``discard`` so callers can
+    release anything waiting on them.
+    """
+
+    def __init__(self,
+                 handler: Callable[[Any], Awaitable],
+                 workers: int = None,
+                 maxsize: int = None,
+                 policy: str = None,
+                 spill_path: str = None,
+                 serialize: Callable[[Any], dict] = None,
+                 restore: Callable[[dict], Awaitable[Optional[Any]]] = None,
+                 discard: Callable[[Any], None] = None):
+        self.handler = handler
+        self.workers = workers or settings.ingest_workers
+        self.maxsize = maxsize or settings.ingest_queue_size
+        self.policy = policy or settings.ingest_overflow_policy
+        if self.policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"未知的队列溢出策略: {self.policy}，可选值: {OVERFLOW_POLICIES}")
+        if self.policy == 'spill' and (serialize is None or restore is None):
+            raise ValueError("spill 策略需要提供 serialize 和 restore")
+        self.spill_path = spill_path or settings.ingest_spill_path
+        self._serialize = serialize
+        self._restore = restore
+        self._discard = discard
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._spilled_pending = 0
+        self._spill_event: Optional[asyncio.Event] = None
+        self.stats = {'enqueued': 0, 'processed': 0, 'failed': 0, 'dropped': 0, 'spilled': 0, 'restored': 0,
+                      'max_depth': 0, 'wait_total': 0.0, 'wait_max': 0.0}
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize() if self._queue else 0
+
+    def _ensure_started(self):
+        """Create the queue and workers on first use, inside the running event loop."""
+        if self._queue is not None:
+            return
+        self._queue = asyncio.Queue(maxsize=self.maxsize)
+        self._spill_event = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        if self.policy == 'spill':
+            self._tasks.append(asyncio.create_task(self._drain_spill()))
+            # 启动时回放上次进程未处理完的溢出消息
+            if os.path.exists(self.spill_path):
+                self._spill_event.set()
+
+    async def put(self, job):
+        """Enqueue ``job`` according to the overflow policy."""
+        self._ensure_started()
+        entry = (time.monotonic(), job)
+        if self._queue.full():
+            if self.policy == 'drop_oldest':
+                _, oldest = self._queue.get_nowait()
+                self._queue.task_done()
+                self.stats['dropped'] += 1
+                self._discarded(oldest)
+            elif self.policy == 'spill':
+                self._spill(job)
+                return
+        await self._queue.put(entry)
+        self.stats['enqueued'] += 1
+        self.stats['max_depth'] = max(self.stats['max_depth'], self._queue.qsize())
+
+    def _discarded(self, job):
+        if self._discard is not None:
+            try:
+                self._discard(job)
+            except Exception as e:
+                logger.error(f"处理被丢弃的消息时出错: {e}")
+
+    def _spill(self, job):
+        try:
+            record = self._serialize(job)
+            os.makedirs(os.path.dirname(self.spill_path) or '.', exist_ok=True)
+            with open(self.spill_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        except Exception as e:
+            logger.error(f"消息写入溢出文件失败，丢弃该消息: {e}")
+            self.stats['dropped'] += 1
+        else:
+            self.stats['spilled'] += 1
+            self._spilled_pending += 1
+            self._spill_event.set()
+        self._discarded(job)
+
+    async def _drain_spill(self):
+        """Feed spilled jobs back into the queue once it has room for them."""
+        while True:
+            await self._spill_event.wait()
+            self._spill_event.clear()
+            while self._queue.qsize() > self.maxsize // 2:
+                await asyncio.sleep(1)
+            if not os.path.exists(self.spill_path):
+                continue
+
+            # 先改名再读取，回放期间新溢出的消息写入新文件
+            draining_path = f"{self.spill_path}.draining"
+            os.replace(self.spill_path, draining_path)
+            with open(draining_path, 'r', encoding='utf-8') as f:
+                records = [json.loads(line) for line in f if line.strip()]
+            logger.info(f"开始回放 {len(records)} 条溢出消息")
+            for record in records:
+                self._spilled_pending = max(self._spilled_pending - 1, 0)
+                try:
+                    job = await self._restore(record)
+                except Exception as e:
+                    logger.error(f"回放溢出消息失败 {record}: {e}")
+                    continue
+                if job is None:
+                    continue
+                await self._queue.put((time.monotonic(), job))
+                self.stats['restored'] += 1
+            os.remove(draining_path)
+
+    async def _worker(self):
+        while True:
+            enqueued_at, job = await self._queue.get()
+            waited = time.monotonic() - enqueued_at
+            self.stats['wait_total'] += waited
+            self.stats['wait_max'] = max(self.stats['wait_max'], waited)
+            try:
+                await self.handler(job)
+                self.stats['processed'] += 1
+            except Exception as e:
+                self.stats['failed'] += 1
+                logger.error(f"处理队列消息时出错: {e}")
+            finally:
+                self._queue.task_done()
+
+    def summary(self) -> str:
+        """Return a one-line report of queue depth, waits and overflow."""
+        started = self.stats['processed'] + self.stats['failed']
+        avg_wait = self.stats['wait_total'] / started if started else 0.0
+        return (f"消息队列（{self.policy}）：排队 {self.depth}/{self.maxsize}，最大 {self.stats['max_depth']}，"
+                f"已处理 {self.stats['processed']}，失败 {self.stats['failed']}，平均等待 {avg_wait:.2f}s，"
+                f"最长等待 {self.stats['wait_max']:.2f}s，丢弃 {self.stats['dropped']}，"
+                f"溢出 {self.stats['spilled']}，回放 {self.stats['restored']}")
@@ -0,0 +1,144 @@
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+from config.settings import settings
+
+logger = settings.get_logger(__name__)
+
+
+class LLMCache:
+    """Content-addressed cache for LLM results.
+
+    Entries are keyed by a hash of (model, system prompt, user prompt, temperature).
+    A bounded in-memory LRU sits in front of a bounded SQLite table, every entry
+    carries its own TTL, and hit/miss counters are kept for both tiers. Values must
+    be JSON serializable.
+    """
+
+    def __init__(self, path: str = None, memory_size: int = None, disk_size: int = None):
+        self.path = path or settings.llm_cache_path
+        self.memory_size = settings.llm_cache_memory_size if memory_size is None else memory_size
+        self.disk_size = settings.llm_cache_disk_size if disk_size is None else disk_size
+
+        self._memory: OrderedDict = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self._writes_since_prune = 0
+        self.stats = {
+            'memory_hits': 0,
+            'disk_hits': 0,
+            'misses': 0,
+            'memory_evictions': 0,
+            'disk_evictions': 0,
+        }
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # 两个bot线程共享同一个连接，所有访问都在self._lock内进行
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS llm_cache ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_accessed ON llm_cache (accessed_at)")
+
+    @staticmethod
+    def make_key(model: str, system_prompt: Optional[str], user_prompt: str, temperature: float) -> str:
+        """Return the content address of one chat completion request."""
+        payload = json.dumps([model, system_prompt or '', user_prompt, temperature], ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[Any]:
+        """Return the cached value for ``key`` or None if missing or expired."""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > now:
+                    self._memory.move_to_end(key)
+                    self.stats['memory_hits'] += 1
+                    return value
+                del self._memory[key]
+
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM llm_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or row[1] <= now:
+                self.stats['misses'] += 1
+                return None
+
+            self._conn.execute("UPDATE llm_cache SET accessed_at = ? WHERE key = ?", (now, key))
+            value = json.loads(row[0])
+            self._remember(key, row[1], value)
+            self.stats['disk_hits'] += 1
+            return value
+
+    def set(self, key: str, value: Any, ttl: float):
+        """Store ``value`` under ``key`` for ``ttl`` seconds in both tiers."""
+        if value is None or not ttl or ttl <= 0:
+            return
+        now = time.time()
+        expires_at = now + ttl
+        with self._lock:
+            self._remember(key, expires_at, value)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), expires_at, now)
+            )
+            self._writes_since_prune += 1
+            if self._writes_since_prune >= 100:
+                self._writes_since_prune = 0
+                self._prune(now)
+
+    async def aget(self, key: str) -> Optional[Any]:
+        """Async ``get``; memory hits return inline, disk lookups run in a thread."""
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and entry[0] > time.time():
+                self._memory.move_to_end(key)
+                self.stats['memory_hits'] += 1
+                return entry[1]
+        return await asyncio.to_thread(self.get, key)
+
+    async def aset(self, key: str, value: Any, ttl: float):
+        await asyncio.to_thread(self.set, key, value, ttl)
+
+    def _remember(self, key: str, expires_at: float, value: Any):
+        self._memory[key] = (expires_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+            self.stats['memory_evictions'] += 1
+
+    def _prune(self, now: float):
+        """Drop expired rows, then the least recently used rows above ``disk_size``."""
+        expired = self._conn.execute("DELETE FROM llm_cache WHERE expires_at <= ?", (now,)).rowcount
+        count = self._conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+        overflow = count - self.disk_size
+        if overflow > 0:
+            self._conn.execute(
+                "DELETE FROM llm_cache WHERE key IN "
+                "(SELECT key FROM llm_cache ORDER BY accessed_at ASC LIMIT ?)",
+                (overflow,)
+            )
+            self.stats['disk_evictions'] += overflow
+        if expired or overflow > 0:
+            logger.info(f"LLM缓存清理：过期 {expired} 条，淘汰 {max(overflow, 0)} 条")
+
+    def summary(self) -> str:
+        """Return a one-line hit/miss summary for logging."""
+        hits = self.stats['memory_hits'] + self.stats['disk_hits']
+        total = hits + self.stats['misses']
+        hit_rate = hits / total if total else 0.0
+        return (f"LLM缓存命中率 {hit_rate:.1%} (内存命中 {self.stats['memory_hits']}, "
+                f"磁盘命中 {self.stats['disk_hits']}, 未命中 {self.stats['misses']}, "
+                f"内存淘汰 {self.stats['memory_evictions']}, 磁盘淘汰 {self.stats['disk_evictions']})")
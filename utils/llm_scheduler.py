@@ -0,0 +1,209 @@
+import asyncio
+import json
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from enum import IntEnum
+from typing import Dict, Optional
+from config.settings import settings
+
+logger = settings.get_logger(__name__)
+
+
+class Priority(IntEnum):
+    """LLM request classes, lower value is served first."""
+    INTERACTIVE = 0  # 用户命令：/news、/twitter_search、/get_history 分析
+    REPORT = 1       # 定时报告：半小时分析、每小时推送
+    BACKGROUND = 2   # 群组消息逐条/批量分类
+    LOW = 3          # 未命中预过滤关键词的低优先级分类
+
+
+class LLMOverloadedError(Exception):
+    """Raised when a queued LLM request is shed because the queue is too deep."""
+
+
+class TokenBucket:
+    """Thread-safe token bucket; callers reserve tokens and sleep for the returned delay.
+
+    Buckets are shared by both bots, so they use a thread lock and wall-clock
+    arithmetic instead of asyncio primitives.
+    """
+
+    def __init__(self, rate_per_minute: float, capacity: float = None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity or max(rate_per_minute, 1.0)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount: float) -> float:
+        """Take ``amount`` tokens (possibly into debt) and return how long to wait."""
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= amount
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    def refund(self, amount: float):
+        """Give back (or, with a negative amount, take) tokens after the real cost is known."""
+        with self._lock:
+            self._tokens = min(self.capacity, self._tokens + amount)
+
+
+_model_buckets: Dict[str, Dict[str, TokenBucket]] = {}
+_model_buckets_lock = threading.Lock()
+
+
+def get_model_buckets(model: str) -> Dict[str, TokenBucket]:
+    """Return the process-wide request and token buckets for ``model``."""
+    with _model_buckets_lock:
+        buckets = _model_buckets.get(model)
+        if buckets is None:
+            limits = {**settings.llm_default_rate_limit, **settings.llm_rate_limits.get(model, {})}
+            buckets = {
+                'requests': TokenBucket(limits.get('rpm', 0)),
+                'tokens': TokenBucket(limits.get('tpm', 0)),
+            }
+            _model_buckets[model] = buckets
+        return buckets
+
+
+def estimate_tokens(*texts: Optional[str]) -> int:
+    """Rough token estimate; CJK text is about one token per character."""
+    return sum(len(text) for text in texts if text)
+
+
+class LLMScheduler:
+    """Priority scheduler in front of the LLM provider for one event loop.
+
+    Requests wait in per-priority queues with round-robin between target chats
+    inside each priority, at most ``max_concurrency`` run at once, and each model
+    is held to its requests-per-minute and tokens-per-minute budget. When more
+    than ``max_queue_depth`` requests are waiting, the lowest-priority background
+    work is shed with ``LLMOverloadedError``.
+    """
+
+    def __init__(self, max_concurrency: int = None, max_queue_depth: int = None):
+        self.max_concurrency = max_concurrency or settings.llm_max_concurrency
+        self.max_queue_depth = max_queue_depth or settings.llm_max_queue_depth
+        # priority -> {chat_key: deque[future]}，同一优先级内按chat_key轮询
+        self._queues: Dict[int, OrderedDict] = {priority: OrderedDict() for priority in Priority}
+        self._active = 0
+        self._queued = 0
+        self.stats = {'completed': 0, 'shed': 0, 'waited': 0, 'wait_total': 0.0, 'wait_max': 0.0}
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queued
+
+    def depth_by_priority(self) -> Dict[str, int]:
+        return {Priority(priority).name: sum(len(w) for w in queue.values()) for priority, queue in self._queues.items()}
+
+    @asynccontextmanager
+    async def slot(self, model: str, priority: int = Priority.BACKGROUND, chat_key=None, estimated_tokens: int = 0):
+        """Wait for a concurrency slot and the model's rate budget, then run the body."""
+        await self._acquire(priority, chat_key)
+        try:
+            buckets = get_model_buckets(model)
+            delay = max(buckets['requests'].reserve(1), buckets['tokens'].reserve(estimated_tokens))
+            if delay > 0:
+                await asyncio.sleep(delay)
+            yield buckets['tokens']
+        finally:
+            self._release()
+
+    async def _acquire(self, priority: int, chat_key):
+        if self._active < self.max_concurrency and self.queue_depth == 0:
+            self._active += 1
+            return
+
+        if self.queue_depth >= self.max_queue_depth and not self._shed(priority):
+            self.stats['shed'] += 1
+            raise LLMOverloadedError(f"LLM队列已满（{self.queue_depth}），丢弃 {Priority(priority).name} 请求")
+
+        future = asyncio.get_running_loop().create_future()
+        enqueued_at = time.monotonic()
+        self._queues[priority].setdefault(chat_key, deque()).append(future)
+        self._queued += 1
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled() and future.exception() is None:
+                # 已获得槽位但调用方被取消，释放槽位
+                self._release()
+            else:
+                self._discard(priority, chat_key, future)
+            raise
+
+        waited = time.monotonic() - enqueued_at
+        self.stats['waited'] += 1
+        self.stats['wait_total'] += waited
+        self.stats['wait_max'] = max(self.stats['wait_max'], waited)
+
+    def _discard(self, priority: int, chat_key, future):
+        waiters = self._queues[priority].get(chat_key)
+        if waiters and future in waiters:
+            waiters.remove(future)
+            self._queued -= 1
+            if not waiters:
+                del self._queues[priority][chat_key]
+
+    def _shed(self, incoming_priority: int) -> bool:
+        """Fail the newest waiter of the deepest chat queue at the lowest sheddable priority below ``incoming_priority``.
+
+        Returns False when nothing queued is less important than the incoming
+        request, in which case the incoming request itself is rejected.
+        """
+        for priority in sorted(self._queues, reverse=True):
+            if priority < Priority.BACKGROUND or priority <= incoming_priority:
+                break
+            queue = self._queues[priority]
+            if not queue:
+                continue
+            # 丢弃排队最多的chat_key的请求，而不是最后加入的chat_key，避免刷屏的群组挤掉其他群组
+            chat_key = max(reversed(queue), key=lambda key: len(queue[key]))
+            future = queue[chat_key].pop()
+            self._queued -= 1
+            if not queue[chat_key]:
+                del queue[chat_key]
+            future.set_exception(LLMOverloadedError(f"LLM队列已满，丢弃 {Priority(priority).name} 请求"))
+            self.stats['shed'] += 1
+            return True
+        return incoming_priority < Priority.BACKGROUND
+
+    def _release(self):
+        self._active -= 1
+        self.stats['completed'] += 1
+        while self._active < self.max_concurrency:
+            future = self._next_waiter()
+            if future is None:
+                return
+            if not future.done():
+                self._active += 1
+                future.set_result(None)
+
+    def _next_waiter(self) -> Optional[asyncio.Future]:
+        for priority in sorted(self._queues):
+            queue = self._queues[priority]
+            if not queue:
+                continue
+            # 同一优先级内按目标群组轮询，避免单个群组占满队列
+            chat_key, waiters = next(iter(queue.items()))
+            future = waiters.popleft()
+            self._queued -= 1
+            del queue[chat_key]
+            if waiters:
+                queue[chat_key] = waiters
+            return future
+        return None
+
+    def summary(self) -> str:
+        """Return a one-line report of queue depth, waits and shed requests."""
+        avg_wait = self.stats['wait_total'] / self.stats['waited'] if self.stats['waited'] else 0.0
+        return (f"LLM调度：运行中 {self._active}/{self.max_concurrency}，排队 {self.queue_depth} "
+                f"{json.dumps(self.depth_by_priority())}，已完成 {self.stats['completed']}，"
+                f"平均等待 {avg_wait:.2f}s，最长等待 {self.stats['wait_max']:.2f}s，丢弃 {self.stats['shed']}")
@@ -0,0 +1,182 @@
+import asyncio
+import os
+import tempfile
+from collections import OrderedDict
+from contextlib import ExitStack
+from typing import List, Optional
+from telegram import InputMediaAudio, InputMediaDocument, InputMediaPhoto, InputMediaVideo
+from config.settings import settings
+from utils.send_dispatcher import Lane, get_send_dispatcher
+
+logger = settings.get_logger(__name__)
+
+# 媒体类型 -> (Bot API发送方法, 参数名, 图标, 说明)
+_SENDERS = {
+    'photo': ('send_photo', 'photo', '📷', '图片'),
+    'animation': ('send_animation', 'animation', '🎞', 'GIF'),
+    'video': ('send_video', 'video', '🎬', '视频'),
+    'voice': ('send_voice', 'voice', '🎤', '语音'),
+    'audio': ('send_audio', 'audio', '🎵', '音频'),
+    'document': ('send_document', 'document', '📎', '文件'),
+}
+# 可以放入send_media_group的媒体类型
+_MEDIA_GROUP_TYPES = {
+    'photo': InputMediaPhoto,
+    'video': InputMediaVideo,
+    'audio': InputMediaAudio,
+    'document': InputMediaDocument,
+}
+CAPTION_LIMIT = 1024
+
+
+class MediaRelay:
+    """Re-sends the media of flagged messages through the bot without a disk round-trip.
+
+    Downloads go into a ``SpooledTemporaryFile`` that stays in memory up to
+    ``memory_bytes`` and only spills to disk above it. Unsupported or oversized
+    media is skipped from the message metadata before anything is fetched, and
+    at most ``max_concurrent`` downloads run at once.
+
+    Telethon file references belong to the user account and cannot be sent by
+    the bot, so reuse works the other way round: after the first upload the bot's
+    own ``file_id`` is remembered under the Telegram media ID, and the same media
+    seen again (e.g. a forwarded post in several groups) is sent by that ID.
+    """
+
+    def __init__(self, memory_bytes: int = None, max_bytes: int = None, max_concurrent: int = None, cache_size: int = 4096):
+        self.memory_bytes = memory_bytes or settings.media_memory_bytes
+        self.max_bytes = max_bytes or settings.media_max_bytes
+        os.makedirs(settings.media_temp_dir, exist_ok=True)
+        self._semaphore = asyncio.Semaphore(max_concurrent or settings.media_max_concurrent_downloads)
+        self._file_ids: OrderedDict = OrderedDict()
+        self._cache_size = cache_size
+        self.stats = {'relayed': 0, 'reused': 0, 'skipped': 0, 'spilled': 0}
+
+    @staticmethod
+    def media_kind(message) -> Optional[str]:
+        """Return which Bot API method can resend ``message``'s media, or None if unsupported."""
+        if message.photo:
+            return 'photo'
+        if message.gif:
+            return 'animation'
+        if message.video and not message.video_note:
+            return 'video'
+        if message.voice:
+            return 'voice'
+        if message.audio:
+            return 'audio'
+        if message.document and not message.sticker:
+            return 'document'
+        return None
+
+    @staticmethod
+    def _media_id(message) -> Optional[int]:
+        media = message.photo or message.document
+        return getattr(media, 'id', None)
+
+    @staticmethod
+    def _sent_file_id(sent, kind: str) -> Optional[str]:
+        if kind == 'photo':
+            return sent.photo[-1].file_id if sent.photo else None
+        attachment = getattr(sent, kind, None) or sent.document
+        return attachment.file_id if attachment else None
+
+    def _remember(self, media_id, file_id):
+        if media_id is None or not file_id:
+            return
+        self._file_ids[media_id] = file_id
+        self._file_ids.move_to_end(media_id)
+        while len(self._file_ids) > self._cache_size:
+            self._file_ids.popitem(last=False)
+
+    async def relay(self, message, bot, chat_id, group_name: str) -> bool:
+        """Send the media of ``message`` to ``chat_id``; returns False if it was skipped."""
+        kind = self.media_kind(message)
+        if kind is None:
+            self.stats['skipped'] += 1
+            logger.info(f"消息ID: {message.id} 的媒体类型不支持转发，跳过下载")
+            return False
+        size = message.file.size if message.file else None
+        if size and size > self.max_bytes:
+            self.stats['skipped'] += 1
+            logger.info(f"消息ID: {message.id} 的媒体大小 {size} 字节超过上限 {self.max_bytes}，跳过下载")
+            return False
+
+        method, argument, icon, label = _SENDERS[kind]
+        caption = f"{icon} 来自 \"{group_name}\" 的{label} | {message.text if message.text else ''}"[:CAPTION_LIMIT]
+        bot_method = getattr(bot, method)
+        dispatcher = get_send_dispatcher(bot)
+
+        async def send(**kwargs):
+            # 媒体与告警文字同属告警队列，按目标群组限速顺序发送
+            return await dispatcher.submit(Lane.ALERT, chat_id, bot_method, **kwargs)
+
+        media_id = self._media_id(message)
+
+        file_id = self._file_ids.get(media_id)
+        if file_id:
+            try:
+                await send(chat_id=chat_id, caption=caption, **{argument: file_id})
+                self.stats['reused'] += 1
+                return True
+            except Exception as e:
+                logger.warning(f"复用file_id发送媒体失败，重新下载: {e}")
+                self._file_ids.pop(media_id, None)
+
+        with ExitStack() as stack:
+            buffer = await self._download(message, stack)
+            extra = {}
+            if kind == 'document' and message.file and message.file.name:
+                extra['filename'] = message.file.name
+            sent = await send(chat_id=chat_id, caption=caption, **{argument: buffer}, **extra)
+        self._remember(media_id, self._sent_file_id(sent, kind))
+        self.stats['relayed'] += 1
+        return True
+
+    async def _download(self, message, stack: ExitStack):
+        buffer = stack.enter_context(tempfile.SpooledTemporaryFile(max_size=self.memory_bytes, dir=settings.media_temp_dir))
+        async with self._semaphore:
+            await message.download_media(file=buffer)
+        if buffer.tell() > self.memory_bytes:
+            self.stats['spilled'] += 1
+        buffer.seek(0)
+        return buffer
+
+    async def relay_album(self, messages: List, bot, chat_id, group_name: str) -> bool:
+        """Send an album as one media group, falling back to single sends for items a group cannot hold."""
+        items = []
+        for message in messages:
+            kind = self.media_kind(message)
+            size = message.file.size if message.file else None
+            if kind in _MEDIA_GROUP_TYPES and not (size and size > self.max_bytes):
+                items.append((message, kind))
+            elif kind is not None:
+                await self.relay(message, bot, chat_id, group_name)
+            else:
+                self.stats['skipped'] += 1
+        if not items:
+            return False
+        if len(items) == 1:
+            return await self.relay(items[0][0], bot, chat_id, group_name)
+
+        caption_message = next((message for message, _ in items if message.text), None)
+        caption = f"🗂 来自 \"{group_name}\" 的相册（{len(items)} 项） | {caption_message.text if caption_message else ''}"[:CAPTION_LIMIT]
+        with ExitStack() as stack:
+            # 未缓存file_id的媒体并发下载，总并发仍受信号量限制
+            downloads = await asyncio.gather(*(
+                asyncio.sleep(0, result=None) if self._file_ids.get(self._media_id(message)) else self._download(message, stack)
+                for message, _ in items
+            ))
+            media = []
+            for index, ((message, kind), buffer) in enumerate(zip(items, downloads)):
+                source = buffer if buffer is not None else self._file_ids[self._media_id(message)]
+                extra = {'caption': caption} if index == 0 else {}
+                if kind == 'document' and buffer is not None and message.file and message.file.name:
+                    extra['filename'] = message.file.name
+                media.append(_MEDIA_GROUP_TYPES[kind](media=source, **extra))
+            sent = await get_send_dispatcher(bot).submit(Lane.ALERT, chat_id, bot.send_media_group, chat_id=chat_id, media=media)
+
+        for (message, kind), sent_message in zip(items, sent):
+            self._remember(self._media_id(message), self._sent_file_id(sent_message, kind))
+        self.stats['relayed'] += len(items)
+        return True
@@ -0,0 +1,116 @@
+import asyncio
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from config.settings import settings
+from utils.llm_scheduler import LLMOverloadedError
+
+logger = settings.get_logger(__name__)
+
+
+class MessageBatcher:
+    """Micro-batching stage for per-message LLM classification.
+
+    Callers await ``classify`` as if it were a single request. Messages from all
+    sources are collected for ``window`` seconds (or until ``max_size`` messages are
+    pending) and classified with one ``classify_batch`` call. Each verdict is then
+    handed back to the caller that submitted the message.
+
+    Low-priority messages (e.g. those without any prefilter keyword) go to a
+    separate lane with a longer window and larger batches.
+    """
+
+    def __init__(self,
+                 classify_batch: Callable[..., Awaitable[Dict[str, dict]]],
+                 classify_one: Callable[..., Awaitable[dict]],
+                 window: float = None,
+                 max_size: int = None):
+        self._classify_batch = classify_batch
+        self._classify_one = classify_one
+        self.window = settings.batch_window_seconds if window is None else window
+        self.max_size = settings.batch_max_size if max_size is None else max_size
+        # 每个通道：(时间窗口, 最大条数)
+        self._lanes = {
+            'normal': (self.window, self.max_size),
+            'low': (settings.batch_low_priority_window_seconds, settings.batch_low_priority_max_size),
+        }
+        self._pending: Dict[str, List[Tuple[str, asyncio.Future]]] = {lane: [] for lane in self._lanes}
+        self._flush_handles: Dict[str, Optional[asyncio.TimerHandle]] = {lane: None for lane in self._lanes}
+        # 保存批处理任务引用，避免任务在执行中被垃圾回收
+        self._tasks = set()
+
+    async def classify(self, text: str, low_priority: bool = False):
+        """Queue ``text`` for the next batch of its lane and wait for its verdict.
+
+        Verdicts are keyed by text, so the same text queued more than once in a
+        batch is classified once and every caller gets that verdict.
+        """
+        lane = 'low' if low_priority else 'normal'
+        window, max_size = self._lanes[lane]
+        if max_size <= 1:
+            return await self._classify_one(text, low_priority=low_priority)
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        pending = self._pending[lane]
+        pending.append((text, future))
+
+        if len(pending) >= max_size:
+            self._flush(lane)
+        elif self._flush_handles[lane] is None:
+            self._flush_handles[lane] = loop.call_later(window, self._flush, lane)
+
+        return await future
+
+    def _flush(self, lane: str):
+        """Hand the pending messages of ``lane`` to a batch task and reset its window."""
+        if self._flush_handles[lane] is not None:
+            self._flush_handles[lane].cancel()
+            self._flush_handles[lane] = None
+
+        batch, self._pending[lane] = self._pending[lane], []
+        if not batch:
+            return
+
+        task = asyncio.create_task(self._run_batch(batch, low_priority=lane == 'low'))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run_batch(self, batch: List[Tuple[str, asyncio.Future]], low_priority: bool = False):
+        # 相同文本（如同一条消息转发到多个目标群组）只分析一次
+        batch_ids: Dict[str, str] = {}
+        for text, _ in batch:
+            if text not in batch_ids:
+                batch_ids[text] = str(len(batch_ids))
+
+        try:
+            verdicts = await self._classify_batch({batch_id: text for text, batch_id in batch_ids.items()}, low_priority=low_priority)
+            logger.info(f"批量分析完成：{len(batch)} 条消息，{len(batch_ids)} 条去重后文本，返回 {len(verdicts)} 个结果")
+        except LLMOverloadedError as e:
+            # 调度器已丢弃该批次，不再逐条重试以免加重负载
+            logger.warning(f"批量分析被丢弃: {e}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        except Exception as e:
+            logger.error(f"批量分析消息失败: {e}")
+            verdicts = {}
+
+        # 批量结果中缺失的消息单独分析，保证每条消息都有结果
+        missing = {text: batch_id for text, batch_id in batch_ids.items() if batch_id not in verdicts}
+        if missing:
+            logger.warning(f"批量结果缺失 {len(missing)} 条，改为逐条分析")
+            results = await asyncio.gather(
+                *(self._classify_one(text, low_priority=low_priority) for text in missing),
+                return_exceptions=True
+            )
+            for batch_id, result in zip(missing.values(), results):
+                verdicts[batch_id] = result
+
+        for text, future in batch:
+            if future.done():
+                continue
+            verdict = verdicts.get(batch_ids[text])
+            if isinstance(verdict, Exception):
+                future.set_exception(verdict)
+            else:
+                future.set_result(verdict)
@@ -0,0 +1,224 @@
+from collections import deque
+from typing import Dict, Iterator, Optional, Tuple
+from config.settings import settings
+
+logger = settings.get_logger(__name__)
+
+
+class BufferedMessage:
+    """Metadata of one buffered message; the text lives in the owning buffer's bytearray."""
+    __slots__ = ('message_id', 'timestamp', 'sender_id', 'offset', 'length', 'cluster')
+
+    def __init__(self, message_id: int, timestamp: float, sender_id: Optional[int], offset: int, length: int, cluster=None):
+        self.message_id = message_id
+        self.timestamp = timestamp
+        self.sender_id = sender_id
+        self.offset = offset
+        self.length = length
+        self.cluster = cluster
+
+
+class BufferSnapshot:
+    """Read-only view of a drained group buffer.
+
+    The snapshot takes over the buffer's records and bytearray instead of
+    copying them; text is decoded from a memoryview only when iterated.
+    """
+    __slots__ = ('group_name', 'records', '_view')
+
+    def __init__(self, group_name: str, records, data: bytearray):
+        self.group_name = group_name
+        self.records = records
+        self._view = memoryview(data)
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def text(self, record: BufferedMessage) -> str:
+        return str(self._view[record.offset:record.offset + record.length], 'utf-8')
+
+    def __iter__(self) -> Iterator[Tuple[BufferedMessage, str]]:
+        for record in self.records:
+            yield record, self.text(record)
+
+
+class GroupBuffer:
+    """Messages of one forward config since the last half-hour report.
+
+    Texts are appended as UTF-8 to one bytearray and records keep offsets into
+    it. Evicting the oldest records leaves dead bytes at the front, which are
+    compacted away once they make up half of the array.
+    """
+
+    def __init__(self, group_name: str):
+        self.group_name = group_name
+        self.records: deque = deque()
+        self.by_message_id: Dict[int, BufferedMessage] = {}
+        self._data = bytearray()
+        self._dead = 0
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    @property
+    def nbytes(self) -> int:
+        return len(self._data) - self._dead
+
+    def text(self, record: BufferedMessage) -> str:
+        return self._data[record.offset:record.offset + record.length].decode('utf-8')
+
+    def append(self, message_id: int, timestamp: float, sender_id: Optional[int], text: str, cluster=None) -> BufferedMessage:
+        encoded = text.encode('utf-8')
+        record = BufferedMessage(message_id, timestamp, sender_id, len(self._data), len(encoded), cluster)
+        self._data += encoded
+        self.records.append(record)
+        self.by_message_id[message_id] = record
+        return record
+
+    def replace_text(self, record: BufferedMessage, text: str):
+        """Point ``record`` at a new text; the old bytes become dead space."""
+        encoded = text.encode('utf-8')
+        self._dead += record.length
+        record.offset, record.length = len(self._data), len(encoded)
+        self._data += encoded
+        self._maybe_compact()
+
+    def evict_oldest(self) -> int:
+        """Drop the oldest record and return how many text bytes it freed."""
+        record = self.records.popleft()
+        if self.by_message_id.get(record.message_id) is record:
+            del self.by_message_id[record.message_id]
+        self._dead += record.length
+        self._maybe_compact()
+        return record.length
+
+    def _maybe_compact(self):
+        if self._dead < 4096 or self._dead * 2 < len(self._data):
+            return
+        data = bytearray()
+        for record in self.records:
+            start = record.offset
+            record.offset = len(data)
+            data += self._data[start:start + record.length]
+        self._data = data
+        self._dead = 0
+
+    def drain(self) -> BufferSnapshot:
+        """Hand the buffered messages to a snapshot and start an empty window."""
+        snapshot = BufferSnapshot(self.group_name, self.records, self._data)
+        self.records = deque()
+        self.by_message_id = {}
+        self._data = bytearray()
+        self._dead = 0
+        return snapshot
+
+
+class MessageBufferPool:
+    """All group buffers of one bot, bounded per group and in total by count and bytes.
+
+    When a group exceeds its own cap its oldest messages are evicted; when the
+    pool exceeds the global cap the oldest messages of the largest group are
+    evicted, so one spammy group cannot push out the others.
+    """
+
+    def __init__(self, max_messages_per_group: int = None, max_bytes_per_group: int = None,
+                 max_messages: int = None, max_bytes: int = None):
+        self.max_messages_per_group = max_messages_per_group or settings.buffer_max_messages_per_group
+        self.max_bytes_per_group = max_bytes_per_group or settings.buffer_max_bytes_per_group
+        self.max_messages = max_messages or settings.buffer_max_messages
+        self.max_bytes = max_bytes or settings.buffer_max_bytes
+        self._groups: Dict[str, GroupBuffer] = {}
+        self.message_count = 0
+        self.nbytes = 0
+        self.stats = {'appended': 0, 'evicted_group': 0, 'evicted_global': 0}
+
+    def __contains__(self, config_id) -> bool:
+        return config_id in self._groups
+
+    def __iter__(self):
+        return iter(list(self._groups))
+
+    def get(self, config_id) -> Optional[GroupBuffer]:
+        return self._groups.get(config_id)
+
+    def group(self, config_id, group_name: str) -> GroupBuffer:
+        """Return the buffer of ``config_id``, creating it if needed."""
+        buffer = self._groups.get(config_id)
+        if buffer is None:
+            buffer = GroupBuffer(group_name)
+            self._groups[config_id] = buffer
+        return buffer
+
+    def remove(self, config_id):
+        buffer = self._groups.pop(config_id, None)
+        if buffer is not None:
+            self.message_count -= len(buffer)
+            self.nbytes -= buffer.nbytes
+
+    def rename(self, old_config_id, new_config_id):
+        """Move a buffer to a new config ID, e.g. after a chat migrated to a supergroup."""
+        buffer = self._groups.pop(old_config_id, None)
+        if buffer is not None:
+            self._groups[new_config_id] = buffer
+
+    def append(self, config_id, group_name: str, message_id: int, timestamp: float, sender_id: Optional[int],
+               text: str, cluster=None) -> BufferedMessage:
+        """Buffer one message for ``config_id`` and enforce the caps."""
+        buffer = self.group(config_id, group_name)
+        before = buffer.nbytes
+        record = buffer.append(message_id, timestamp, sender_id, text, cluster)
+        self.message_count += 1
+        self.nbytes += buffer.nbytes - before
+        self.stats['appended'] += 1
+
+        while len(buffer) > 1 and (len(buffer) > self.max_messages_per_group or buffer.nbytes > self.max_bytes_per_group):
+            self._evict(buffer)
+            self.stats['evicted_group'] += 1
+        while self.message_count > self.max_messages or self.nbytes > self.max_bytes:
+            largest = max(self._groups.values(), key=lambda group: group.nbytes)
+            if not len(largest):
+                break
+            self._evict(largest)
+            self.stats['evicted_global'] += 1
+        return record
+
+    def replace_text(self, config_id, record: BufferedMessage, text: str):
+        buffer = self._groups.get(config_id)
+        if buffer is None:
+            return
+        before = buffer.nbytes
+        buffer.replace_text(record, text)
+        self.nbytes += buffer.nbytes - before
+
+    def _evict(self, buffer: GroupBuffer):
+        self.nbytes -= buffer.evict_oldest()
+        self.message_count -= 1
+
+    def drain(self, config_id) -> Optional[BufferSnapshot]:
+        """Take the messages buffered for ``config_id`` since the last drain."""
+        buffer = self._groups.get(config_id)
+        if buffer is None:
+            return None
+        self.message_count -= len(buffer)
+        self.nbytes -= buffer.nbytes
+        return buffer.drain()
+
+    def restore(self, config_id, snapshot: BufferSnapshot):
+        """Put a drained snapshot back in front of the messages buffered since, e.g. when its report failed."""
+        newer = self._groups.pop(config_id, None)
+        if newer is not None:
+            self.message_count -= len(newer)
+            self.nbytes -= newer.nbytes
+        group_name = newer.group_name if newer is not None else snapshot.group_name
+        for record, text in snapshot:
+            self.append(config_id, group_name, record.message_id, record.timestamp, record.sender_id, text, record.cluster)
+        if newer is not None:
+            for record in newer.records:
+                self.append(config_id, group_name, record.message_id, record.timestamp, record.sender_id,
+                            newer.text(record), record.cluster)
+
+    def summary(self) -> str:
+        """Return a one-line report of buffered volume and evictions."""
+        return (f"消息缓冲：{len(self._groups)} 个群组，{self.message_count}/{self.max_messages} 条，"
+                f"{self.nbytes / 1024:.1f}/{self.max_bytes / 1024:.0f} KB，"
+                f"单群组超限淘汰 {self.stats['evicted_group']}，全局超限淘汰 {self.stats['evicted_global']}")
@@ -0,0 +1,216 @@
+import asyncio
+import json
+import mmap
+import os
+import struct
+import time
+from typing import Dict, List, Optional
+from config.settings import settings
+
+logger = settings.get_logger(__name__)
+
+_HEADER = struct.Struct('>I')
+_SEGMENT_PREFIX = 'segment-'
+_SEGMENT_SUFFIX = '.log'
+
+
+class MessageSpool:
+    """Append-only on-disk log of buffered group messages.
+
+    Every buffered message is appended to the current segment as a
+    length-prefixed JSON frame. Writes are fsynced in batches, at most every
+    ``fsync_interval`` seconds, rather than once per message. Edits are logged as
+    separate frames that replay applies to the earlier message. When a half-hour
+    report drains a buffer, a drain frame is appended for its config; segments
+    whose messages have all been drained are deleted. Frames carry a sequence
+    number, and a drain frame covers only the frames up to the checkpoint taken
+    when the buffer was drained, so messages that arrive while the report is
+    still being generated stay pending. When a config ID changes after a group
+    migration, a rename frame moves its pending messages to the new ID. After a
+    restart ``replay`` reads the segments through mmap and returns the messages
+    that were buffered but never reported.
+    """
+
+    def __init__(self, directory: str = None, fsync_interval: float = None, segment_bytes: int = None):
+        self.directory = directory or settings.spool_dir
+        self.fsync_interval = settings.spool_fsync_interval if fsync_interval is None else fsync_interval
+        self.segment_bytes = segment_bytes or settings.spool_segment_bytes
+        os.makedirs(self.directory, exist_ok=True)
+        # 段序号 -> {该段中尚未被定时分析取走的配置ID: 该配置在段中最大的记录序号}
+        self._pending: Dict[int, Dict[str, int]] = {}
+        self._seq = 0
+        self._file = None
+        self._segment = 0
+        self._sync_handle: Optional[asyncio.TimerHandle] = None
+        self.stats = {'appended': 0, 'fsyncs': 0, 'segments_deleted': 0}
+
+    def _path(self, segment: int) -> str:
+        return os.path.join(self.directory, f"{_SEGMENT_PREFIX}{segment:08d}{_SEGMENT_SUFFIX}")
+
+    def _segments(self) -> List[int]:
+        segments = []
+        for name in os.listdir(self.directory):
+            if name.startswith(_SEGMENT_PREFIX) and name.endswith(_SEGMENT_SUFFIX):
+                segments.append(int(name[len(_SEGMENT_PREFIX):-len(_SEGMENT_SUFFIX)]))
+        return sorted(segments)
+
+    @staticmethod
+    def _frames(path: str):
+        """Yield the decoded frames of a segment, stopping at a torn tail write."""
+        if os.path.getsize(path) == 0:
+            return
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as view:
+            position = 0
+            while position + _HEADER.size <= len(view):
+                (length,) = _HEADER.unpack_from(view, position)
+                start = position + _HEADER.size
+                if start + length > len(view):
+                    logger.warning(f"消息日志 {path} 末尾记录不完整，已忽略")
+                    return
+                try:
+                    yield json.loads(view[start:start + length])
+                except ValueError:
+                    logger.warning(f"消息日志 {path} 中存在损坏记录，已忽略")
+                position = start + length
+
+    def replay(self) -> Dict[str, List[dict]]:
+        """Return the undrained message records of every config, oldest first.
+
+        Also reopens the log for appending in a fresh segment.
+        """
+        pending: Dict[str, List[dict]] = {}
+        for segment in self._segments():
+            configs = {}
+            self._pending[segment] = configs
+            for frame in self._frames(self._path(segment)):
+                config_id = frame.get('c')
+                seq = frame.get('n', 0)
+                self._seq = max(self._seq, seq)
+                if frame.get('t') == 'd':
+                    # 旧格式的取走记录不带检查点，表示该配置此前的所有消息
+                    upto = frame.get('upto', self._seq)
+                    records = [record for record in pending.get(config_id, []) if record.get('n', 0) > upto]
+                    if records:
+                        pending[config_id] = records
+                    else:
+                        pending.pop(config_id, None)
+                    self._discard_drained(config_id, upto)
+                elif frame.get('t') == 'm':
+                    pending.setdefault(config_id, []).append(frame)
+                    configs[config_id] = max(configs.get(config_id, 0), seq)
+                elif frame.get('t') == 'e':
+                    for record in reversed(pending.get(config_id, [])):
+                        if record['i'] == frame['i']:
+                            record['x'] = frame['x']
+                            break
+                    configs[config_id] = max(configs.get(config_id, 0), seq)
+                elif frame.get('t') == 'r':
+                    records = pending.pop(config_id, [])
+                    if records:
+                        pending.setdefault(frame['to'], []).extend(records)
+                    self._move_pending(config_id, frame['to'])
+                    configs[frame['to']] = max(configs.get(frame['to'], 0), seq)
+            self._segment = segment
+        self._delete_drained()
+        self._open_segment(self._segment + 1)
+        if pending:
+            logger.info(f"从消息日志恢复 {sum(len(records) for records in pending.values())} 条未分析消息（{len(pending)} 个配置）")
+        return pending
+
+    def _open_segment(self, segment: int):
+        if self._file is not None:
+            self._sync()
+            self._file.close()
+        self._segment = segment
+        self._pending.setdefault(segment, {})
+        self._file = open(self._path(segment), 'ab')
+
+    def _write(self, frame: dict):
+        self._seq += 1
+        frame['n'] = self._seq
+        if self._file is None:
+            self._open_segment(max(self._segments(), default=0) + 1)
+        payload = json.dumps(frame, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        self._file.write(_HEADER.pack(len(payload)) + payload)
+        self._schedule_sync()
+        if self._file.tell() >= self.segment_bytes:
+            self._open_segment(self._segment + 1)
+
+    def append(self, config_id: str, group_name: str, message_id: int, timestamp: float, sender_id: Optional[int], text: str):
+        """Log one buffered message."""
+        self._write({'t': 'm', 'c': config_id, 'g': group_name, 'i': message_id, 'ts': timestamp, 's': sender_id, 'x': text})
+        self._pending[self._segment][config_id] = self._seq
+        self.stats['appended'] += 1
+
+    def replace(self, config_id: str, message_id: int, text: str):
+        """Log an edit of a message logged earlier."""
+        self._write({'t': 'e', 'c': config_id, 'i': message_id, 'x': text})
+        self._pending[self._segment][config_id] = self._seq
+
+    def rename(self, old_id: str, new_id: str):
+        """Log that ``old_id``'s pending messages now belong to ``new_id``."""
+        self._write({'t': 'r', 'c': old_id, 'to': new_id})
+        self._move_pending(old_id, new_id)
+        # 改名记录所在的段要保留到新配置取走为止，否则重启后早先段中的消息仍归在旧配置下
+        self._pending[self._segment][new_id] = self._seq
+
+    def _move_pending(self, old_id: str, new_id: str):
+        for configs in self._pending.values():
+            if old_id in configs:
+                configs[new_id] = max(configs.get(new_id, 0), configs.pop(old_id))
+
+    def checkpoint(self) -> int:
+        """Return the sequence number of the last frame written, to pass to ``mark_drained`` later."""
+        return self._seq
+
+    def mark_drained(self, config_id: str, upto: int = None):
+        """Record that ``config_id``'s frames up to checkpoint ``upto`` (default: all so far) have been reported."""
+        upto = self._seq if upto is None else upto
+        self._write({'t': 'd', 'c': config_id, 'ts': time.time(), 'upto': upto})
+        self._discard_drained(config_id, upto)
+        self._delete_drained()
+
+    def _discard_drained(self, config_id: str, upto: int):
+        for configs in self._pending.values():
+            if configs.get(config_id, 0) <= upto:
+                configs.pop(config_id, None)
+
+    def _delete_drained(self):
+        for segment in sorted(self._pending):
+            if segment == self._segment or self._pending[segment]:
+                continue
+            del self._pending[segment]
+            try:
+                os.remove(self._path(segment))
+                self.stats['segments_deleted'] += 1
+            except FileNotFoundError:
+                pass
+
+    def _schedule_sync(self):
+        if self.fsync_interval <= 0:
+            self._sync()
+            return
+        if self._sync_handle is None:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                self._sync()
+                return
+            self._sync_handle = loop.call_later(self.fsync_interval, self._sync)
+
+    def _sync(self):
+        """Flush and fsync everything written since the last sync."""
+        if self._sync_handle is not None:
+            self._sync_handle.cancel()
+            self._sync_handle = None
+        if self._file is None or self._file.closed:
+            return
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self.stats['fsyncs'] += 1
+
+    def close(self):
+        if self._file is not None:
+            self._sync()
+            self._file.close()
+            self._file = None
@@ -0,0 +1,111 @@
+import asyncio
+import concurrent.futures
+import threading
+import time
+from collections import deque
+from typing import Awaitable, Callable, Dict
+from config.settings import settings
+
+logger = settings.get_logger(__name__)
+
+# 同步调用（smolagents工具）对冲时使用的线程池
+_hedge_executor = concurrent.futures.ThreadPoolExecutor(max_workers=8, thread_name_prefix="llm-hedge")
+
+
+class ModelRouter:
+    """Routes each LLM call site to a model and hedges slow primaries.
+
+    Routes come from ``settings.llm_routes``. Each route tracks the recent
+    latencies of its primary model; when the primary has not answered within its
+    p95 latency (capped by the route's SLO) and a fallback model is configured,
+    the same request is sent to the fallback and whichever answers first wins.
+    """
+
+    def __init__(self, window: int = 200, min_samples: int = 20):
+        self.min_samples = min_samples
+        self._latencies: Dict[str, deque] = {}
+        self._window = window
+        self._lock = threading.Lock()
+        self.stats = {'hedged': 0, 'fallback_wins': 0}
+
+    def route(self, name: str) -> dict:
+        return settings.llm_routes.get(name) or {'model': settings.model_id}
+
+    def model_for(self, name: str) -> str:
+        return self.route(name).get('model') or settings.model_id
+
+    def record(self, name: str, seconds: float):
+        with self._lock:
+            self._latencies.setdefault(name, deque(maxlen=self._window)).append(seconds)
+
+    def hedge_delay(self, name: str) -> float:
+        """Return how long to wait for the primary before hedging."""
+        slo = self.route(name).get('slo_seconds', 30)
+        with self._lock:
+            samples = sorted(self._latencies.get(name, ()))
+        if len(samples) < self.min_samples:
+            return slo
+        return min(samples[int(len(samples) * 0.95) - 1], slo)
+
+    def _timed(self, name: str, started: float):
+        def callback(result):
+            if not result.cancelled() and result.exception() is None:
+                self.record(name, time.monotonic() - started)
+        return callback
+
+    async def run(self, name: str, call: Callable[[str], Awaitable]):
+        """Run ``call(model)`` on the route's primary, hedging to the fallback if it is slow."""
+        route = self.route(name)
+        primary = asyncio.ensure_future(call(self.model_for(name)))
+        primary.add_done_callback(self._timed(name, time.monotonic()))
+        fallback_model = route.get('fallback_model')
+        if not fallback_model:
+            return await primary
+
+        done, _ = await asyncio.wait({primary}, timeout=self.hedge_delay(name))
+        if done:
+            return primary.result()
+
+        logger.info(f"路由 {name} 主模型超过 {self.hedge_delay(name):.1f}s 未返回，对冲请求备用模型 {fallback_model}")
+        self.stats['hedged'] += 1
+        secondary = asyncio.ensure_future(call(fallback_model))
+        pending = {primary, secondary}
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is secondary:
+                            self.stats['fallback_wins'] += 1
+                        return task.result()
+            # 两个请求都失败时抛出主模型的异常
+            return primary.result()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def run_sync(self, name: str, call: Callable[[str], object]):
+        """Blocking variant of ``run`` for code that runs outside the event loop."""
+        route = self.route(name)
+        started = time.monotonic()
+        primary = _hedge_executor.submit(call, self.model_for(name))
+        primary.add_done_callback(self._timed(name, started))
+        fallback_model = route.get('fallback_model')
+        if not fallback_model:
+            return primary.result()
+
+        done, _ = concurrent.futures.wait({primary}, timeout=self.hedge_delay(name))
+        if done:
+            return primary.result()
+
+        self.stats['hedged'] += 1
+        secondary = _hedge_executor.submit(call, fallback_model)
+        pending = {primary, secondary}
+        while pending:
+            done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is secondary:
+                        self.stats['fallback_wins'] += 1
+                    return future.result()
+        return primary.result()
@@ -0,0 +1,193 @@
+import asyncio
+import os
+import random
+import sqlite3
+import threading
+import time
+from typing import Callable, Optional
+import telegram
+from config.settings import settings
+from utils.send_dispatcher import Lane, get_send_dispatcher
+
+logger = settings.get_logger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    chat_id TEXT NOT NULL,
+    text TEXT NOT NULL,
+    parse_mode TEXT,
+    lane INTEGER NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt REAL NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    last_error TEXT,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS outbox_due ON outbox (status, next_attempt);
+"""
+
+
+class Outbox:
+    """SQLite-backed queue of outgoing messages with at-least-once delivery.
+
+    ``send`` writes the message to disk before the first attempt and deletes it
+    only after Telegram accepted it, so a message in flight during a crash is
+    sent again on the next start. Transient failures are retried with
+    exponential backoff and jitter. A ``ChatMigrated`` error is resent to the
+    new chat ID at once; permanent errors (``BadRequest``, ``Forbidden``) and
+    messages that used up ``max_attempts`` are kept as dead letters. Retries go through the send dispatcher in batches, so they share
+    its lanes and rate limits with every other send.
+    """
+
+    def __init__(self, path: str, on_migrated: Callable = None, max_attempts: int = None,
+                 base_delay: float = None, max_delay: float = None, batch_size: int = None):
+        self.path = path
+        self.on_migrated = on_migrated
+        self.max_attempts = max_attempts or settings.outbox_max_attempts
+        self.base_delay = base_delay or settings.outbox_base_delay
+        self.max_delay = max_delay or settings.outbox_max_delay
+        self.batch_size = batch_size or settings.outbox_batch_size
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._lock = threading.Lock()
+        # 连接在主线程创建，之后在bot线程的事件循环中使用，所有访问都在self._lock内进行
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._lock:
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('PRAGMA synchronous=NORMAL')
+            self._db.executescript(_SCHEMA)
+            self._db.commit()
+        self._bot = None
+        self._inflight = set()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._worker: Optional[asyncio.Task] = None
+        self.stats = {'delivered': 0, 'retried': 0, 'dead': 0}
+
+    def start(self, bot):
+        """Start the retry worker, resuming whatever is left in the queue from the last run."""
+        self._bot = bot
+        if self._worker is None or self._worker.done():
+            self._wakeup = asyncio.Event()
+            self._worker = asyncio.create_task(self._run())
+            with self._lock:
+                pending = self._db.execute("SELECT COUNT(*) FROM outbox WHERE status = 'pending'").fetchone()[0]
+            if pending:
+                logger.info(f"发送队列中有 {pending} 条未送达消息，继续发送")
+
+    async def send(self, bot, chat_id, text: str, lane: int = Lane.ALERT, parse_mode: str = None):
+        """Persist and send a message; returns the chat ID it reached, or None if it was queued for retry."""
+        self.start(bot)
+        now = time.time()
+        with self._lock:
+            cursor = self._db.execute(
+                "INSERT INTO outbox (chat_id, text, parse_mode, lane, next_attempt, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (str(chat_id), text, parse_mode and str(parse_mode), int(lane), now, now)
+            )
+            self._db.commit()
+        row = (cursor.lastrowid, str(chat_id), text, parse_mode and str(parse_mode), int(lane), 0)
+        return await self._deliver(row)
+
+    async def _deliver(self, row):
+        row_id, chat_id, text, parse_mode, lane, attempts = row
+        self._inflight.add(row_id)
+        try:
+            kwargs = {'parse_mode': parse_mode} if parse_mode else {}
+            dispatcher = get_send_dispatcher(self._bot)
+            try:
+                await dispatcher.send_message(self._bot, chat_id, text, lane=lane, **kwargs)
+            except telegram.error.ChatMigrated as e:
+                # 群组迁移为超级群组时改用新ID重发，不计入重试次数
+                new_chat_id = str(e.new_chat_id)
+                logger.info(f"群组已迁移到超级群组。旧ID: {chat_id}, 新ID: {new_chat_id}")
+                with self._lock:
+                    self._db.execute("UPDATE outbox SET chat_id = ? WHERE chat_id = ?", (new_chat_id, chat_id))
+                    self._db.commit()
+                if self.on_migrated:
+                    self.on_migrated(chat_id, new_chat_id)
+                chat_id = new_chat_id
+                await dispatcher.send_message(self._bot, chat_id, text, lane=lane, **kwargs)
+        except (telegram.error.BadRequest, telegram.error.Forbidden, telegram.error.InvalidToken) as e:
+            self._dead(row_id, attempts + 1, e)
+            return None
+        except Exception as e:
+            self._retry(row_id, attempts + 1, e)
+            return None
+        else:
+            with self._lock:
+                self._db.execute("DELETE FROM outbox WHERE id = ?", (row_id,))
+                self._db.commit()
+            self.stats['delivered'] += 1
+            return chat_id
+        finally:
+            self._inflight.discard(row_id)
+
+    def _backoff(self, attempts: int) -> float:
+        # 指数退避，取上限后在后一半区间内随机抖动，避免大量消息同时重试
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempts - 1))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def _retry(self, row_id, attempts: int, error: Exception):
+        if attempts >= self.max_attempts:
+            self._dead(row_id, attempts, error)
+            return
+        delay = self._backoff(attempts)
+        with self._lock:
+            self._db.execute(
+                "UPDATE outbox SET attempts = ?, next_attempt = ?, last_error = ? WHERE id = ?",
+                (attempts, time.time() + delay, str(error), row_id)
+            )
+            self._db.commit()
+        self.stats['retried'] += 1
+        logger.warning(f"消息发送失败（第 {attempts} 次），{delay:.1f} 秒后重试: {error}")
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def _dead(self, row_id, attempts: int, error: Exception):
+        with self._lock:
+            self._db.execute(
+                "UPDATE outbox SET status = 'dead', attempts = ?, last_error = ? WHERE id = ?",
+                (attempts, str(error), row_id)
+            )
+            self._db.commit()
+        self.stats['dead'] += 1
+        logger.error(f"消息发送失败 {attempts} 次，已放入死信: {error}")
+
+    async def _run(self):
+        while True:
+            with self._lock:
+                rows = [row for row in self._db.execute(
+                    "SELECT id, chat_id, text, parse_mode, lane, attempts FROM outbox "
+                    "WHERE status = 'pending' AND next_attempt <= ? ORDER BY lane, id LIMIT ?",
+                    (time.time(), self.batch_size + len(self._inflight))
+                ) if row[0] not in self._inflight][:self.batch_size]
+            if rows:
+                # 一批消息同时交给发送调度器，由其按群组和全局限速、并保持同一群组内的顺序
+                await asyncio.gather(*(self._deliver(row) for row in rows))
+                continue
+
+            with self._lock:
+                next_row = self._db.execute(
+                    "SELECT MIN(next_attempt) FROM outbox WHERE status = 'pending'"
+                ).fetchone()[0]
+            # 已到期的消息都在发送中时等待轮询或重试唤醒
+            timeout = settings.outbox_poll_interval
+            if next_row is not None and next_row > time.time():
+                timeout = min(next_row - time.time(), timeout)
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def summary(self) -> str:
+        """Return a one-line report of the queue."""
+        with self._lock:
+            counts = dict(self._db.execute("SELECT status, COUNT(*) FROM outbox GROUP BY status").fetchall())
+        return (f"发送队列：待发送 {counts.get('pending', 0)} 条，死信 {counts.get('dead', 0)} 条，"
+                f"已送达 {self.stats['delivered']}，重试 {self.stats['retried']}，放入死信 {self.stats['dead']}")
+
+    def close(self):
+        if self._worker is not None:
+            self._worker.cancel()
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,142 @@
+import json
+from collections import Counter, deque
+from typing import Dict, Iterable, List
+from config.settings import settings
+from config.keywords import prefilter_keywords
+
+logger = settings.get_logger(__name__)
+
+# 英文关键词后允许的词形变化，如 protests、bombing、protesters
+_ENGLISH_SUFFIXES = {'', 's', 'es', 'ed', 'ing', 'er', 'ers'}
+
+
+def _is_word_char(char: str) -> bool:
+    # 只把ASCII字母数字视为单词的一部分，英文关键词紧挨中文时仍能命中
+    return char.isascii() and char.isalnum()
+
+
+class AhoCorasick:
+    """Multi-pattern substring matcher (Aho-Corasick automaton).
+
+    All patterns are found in a single pass over the text, so the cost of a scan
+    does not grow with the number of keywords. Matching is case-insensitive.
+    ASCII patterns only match whole words (optionally with a plural or verb
+    suffix), so "riot" does not match "patriot"; other patterns, such as CJK
+    keywords, match anywhere.
+    """
+
+    def __init__(self, patterns: Iterable[str]):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._output: List[List[str]] = [[]]
+        self._whole_word = set()
+
+        for pattern in patterns:
+            if pattern:
+                self._add(pattern)
+        self._build_failure_links()
+
+    def _add(self, pattern: str):
+        state = 0
+        for char in pattern.lower():
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+                self._goto[state][char] = next_state
+            state = next_state
+        self._output[state].append(pattern)
+        if pattern.isascii():
+            self._whole_word.add(pattern)
+
+    def _build_failure_links(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_state] = self._goto[fail].get(char, 0)
+                self._output[next_state] = self._output[next_state] + self._output[self._fail[next_state]]
+
+    def search(self, text: str, first_only: bool = False) -> List[str]:
+        """Return the patterns found in ``text`` (with repeats, in match order)."""
+        found = []
+        state = 0
+        goto, fail, output = self._goto, self._fail, self._output
+        text = text.lower()
+        for index, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if not output[state]:
+                continue
+            for pattern in output[state]:
+                if pattern in self._whole_word and not self._is_whole_word(text, index - len(pattern) + 1, index + 1):
+                    continue
+                found.append(pattern)
+                if first_only:
+                    return found
+        return found
+
+    @staticmethod
+    def _is_whole_word(text: str, start: int, end: int) -> bool:
+        if start > 0 and _is_word_char(text[start - 1]):
+            return False
+        tail = end
+        while tail < len(text) and _is_word_char(text[tail]):
+            tail += 1
+        return text[end:tail] in _ENGLISH_SUFFIXES
+
+
+class KeywordPrefilter:
+    """Local first stage in front of the analyze_message LLM call.
+
+    Messages that mention none of the configured leader names, aliases, places
+    or action verbs are either skipped or sent to the low-priority lane,
+    depending on ``settings.prefilter_mode``. Counters are kept so the skip rate
+    can be tuned.
+    """
+
+    def __init__(self, keywords: Dict[str, List[str]] = None):
+        self.keywords = keywords or self.load_keywords()
+        self._automaton = AhoCorasick(word for words in self.keywords.values() for word in words)
+        self.checked = 0
+        self.unmatched = 0
+        self.keyword_hits = Counter()
+
+    @staticmethod
+    def load_keywords() -> Dict[str, List[str]]:
+        """Load the keyword table from PREFILTER_KEYWORDS_FILE, falling back to the defaults."""
+        path = settings.prefilter_keywords_file
+        if path:
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+            except Exception as e:
+                logger.error(f"加载预过滤词表失败，使用默认词表: {e}")
+        return prefilter_keywords
+
+    def check(self, text: str) -> List[str]:
+        """Return the distinct keywords found in ``text``; empty means no match."""
+        matched = list(dict.fromkeys(self._automaton.search(text or '')))
+        self.checked += 1
+        if matched:
+            self.keyword_hits.update(matched)
+        else:
+            self.unmatched += 1
+        return matched
+
+    @property
+    def skip_rate(self) -> float:
+        return self.unmatched / self.checked if self.checked else 0.0
+
+    def summary(self) -> str:
+        """Return a one-line report of the skip rate and the most frequent keywords."""
+        top = ', '.join(f"{word}×{count}" for word, count in self.keyword_hits.most_common(10))
+        return (f"预过滤({settings.prefilter_mode})：检查 {self.checked} 条，未命中 {self.unmatched} 条，"
+                f"未命中率 {self.skip_rate:.1%}，高频关键词：{top or '无'}")
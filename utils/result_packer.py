@@ -0,0 +1,71 @@
+import io
+from datetime import datetime
+from typing import Iterable, List, Optional
+from config.settings import settings
+from utils.send_dispatcher import Lane, get_send_dispatcher
+from utils.text_splitter import MESSAGE_LIMIT, split_text, text_length
+
+logger = settings.get_logger(__name__)
+
+ITEM_SEPARATOR = "\n\n"
+
+
+def pack_items(items: Iterable[str], limit: int = MESSAGE_LIMIT, separator: str = ITEM_SEPARATOR) -> List[str]:
+    """Pack ``items`` in order into as few messages of at most ``limit`` characters as possible.
+
+    Items are never split across messages; only an item that alone exceeds
+    ``limit`` is split by ``split_text`` and its parts are sent on their own.
+    Since the order of results matters, items are filled greedily in sequence,
+    which is already the minimum number of messages for an order-preserving
+    packing.
+    """
+    messages, current = [], ''
+    for item in items:
+        item = item.strip() if item else ''
+        if not item:
+            continue
+        if text_length(item) > limit:
+            if current:
+                messages.append(current)
+                current = ''
+            messages.extend(split_text(item, limit))
+            continue
+        candidate = f"{current}{separator}{item}" if current else item
+        if text_length(candidate) <= limit:
+            current = candidate
+        else:
+            messages.append(current)
+            current = item
+    if current:
+        messages.append(current)
+    return messages
+
+
+def build_document(items: Iterable[str], title: str) -> io.BytesIO:
+    """Render ``items`` as one Markdown file with a heading."""
+    body = "\n\n---\n\n".join(item.strip() for item in items if item and item.strip())
+    document = io.BytesIO(f"# {title}\n\n{body}\n".encode('utf-8'))
+    document.name = f"results_{datetime.now().strftime('%Y%m%d_%H%M%S')}.md"
+    return document
+
+
+async def send_items(bot, chat_id, items: List[str], header: Optional[str] = None, lane: int = Lane.INTERACTIVE,
+                     document_threshold: int = None) -> int:
+    """Send result ``items`` packed into as few messages as possible; returns the number of sends.
+
+    When packing still needs more than ``document_threshold`` messages the
+    items are sent as a single Markdown document instead (0 disables this).
+    """
+    dispatcher = get_send_dispatcher(bot)
+    threshold = settings.result_document_threshold if document_threshold is None else document_threshold
+    packed = pack_items(([header] if header else []) + list(items))
+    if threshold and len(packed) > threshold:
+        logger.info(f"结果需要 {len(packed)} 条消息，改为发送文件")
+        document = build_document(items, header or '查询结果')
+        await dispatcher.submit(lane, chat_id, bot.send_document, chat_id=chat_id, document=document,
+                                filename=document.name, caption=header)
+        return 1
+    for text in packed:
+        # 逐条等待，保证多条消息按顺序到达
+        await dispatcher.send_message(bot, chat_id, text, lane=lane)
+    return len(packed)
@@ -0,0 +1,206 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict, deque
+from enum import IntEnum
+from typing import Awaitable, Callable, Dict, Optional
+import telegram
+from config.settings import settings
+from utils.llm_scheduler import TokenBucket
+from utils.text_splitter import MESSAGE_LIMIT, split_text, text_length
+
+logger = settings.get_logger(__name__)
+
+
+class Lane(IntEnum):
+    """Outgoing message classes, lower value is sent first."""
+    ALERT = 0        # 舆情告警
+    INTERACTIVE = 1  # 用户命令的回复
+    REPORT = 2       # 半小时分析、每小时推送
+    BULK = 3         # 历史消息等大批量发送
+
+
+class _SendJob:
+    __slots__ = ('lane', 'chat_id', 'call', 'future', 'attempts')
+
+    def __init__(self, lane: int, chat_id, call: Callable[[], Awaitable], future: asyncio.Future):
+        self.lane = lane
+        self.chat_id = chat_id
+        self.call = call
+        self.future = future
+        self.attempts = 0
+
+
+class SendDispatcher:
+    """Paces every outgoing Bot API call of one bot.
+
+    Calls wait in per-lane FIFO queues and are released highest lane first,
+    within Telegram's global limit (about 30 messages per second) and per-chat
+    limits (about 20 per minute in groups, one per second in private chats).
+    A chat whose budget is used up is skipped so other chats keep moving, and
+    only one call per chat is in flight so messages arrive in order. A
+    ``RetryAfter`` from Telegram pauses the whole dispatcher for the requested
+    time and puts the call back at the head of its lane.
+    """
+
+    def __init__(self, global_rate: float = None, group_rate: float = None, private_rate: float = None,
+                 max_attempts: int = 5, max_chats: int = 10000):
+        self.global_rate = global_rate or settings.send_global_rate
+        self.group_rate = group_rate or settings.send_group_rate_per_minute
+        self.private_rate = private_rate or settings.send_private_rate_per_minute
+        self.max_attempts = max_attempts
+        self.max_chats = max_chats
+        self._global = TokenBucket(self.global_rate * 60, capacity=self.global_rate)
+        self._chat_buckets: OrderedDict = OrderedDict()
+        self._lanes: Dict[int, deque] = {lane: deque() for lane in Lane}
+        self._inflight = set()
+        self._paused_until = 0.0
+        self._wakeup: Optional[asyncio.Event] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._tasks = set()
+        self.stats = {'sent': 0, 'failed': 0, 'retry_after': 0}
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            # 群组和频道ID为负数（或为@用户名），私聊ID为正数
+            rate = self.group_rate if chat_id.startswith(('-', '@')) else self.private_rate
+            bucket = TokenBucket(rate, capacity=max(rate / 20, 1))
+            self._chat_buckets[chat_id] = bucket
+            while len(self._chat_buckets) > self.max_chats:
+                self._chat_buckets.popitem(last=False)
+        else:
+            self._chat_buckets.move_to_end(chat_id)
+        return bucket
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(len(queue) for queue in self._lanes.values())
+
+    async def submit(self, lane: int, chat_id, func: Callable[..., Awaitable], /, *args, **kwargs):
+        """Queue ``func(*args, **kwargs)`` as a send to ``chat_id`` and return its result."""
+        if self._worker is None or self._worker.done():
+            self._wakeup = asyncio.Event()
+            self._worker = asyncio.create_task(self._run())
+        future = asyncio.get_running_loop().create_future()
+        # 同一群组的整数ID和字符串ID共用一个限速桶
+        self._lanes[lane].append(_SendJob(lane, str(chat_id), lambda: func(*args, **kwargs), future))
+        self._wakeup.set()
+        return await future
+
+    async def send_message(self, bot, chat_id, text: str, lane: int = Lane.INTERACTIVE, **kwargs):
+        """Queue ``bot.send_message`` for ``chat_id``, returning the last message sent.
+
+        Text over Telegram's length limit is split on paragraph or line
+        boundaries (keeping HTML tags balanced for ``ParseMode.HTML``) and the
+        parts are sent in order instead of failing with ``BadRequest``.
+        """
+        if text_length(text) <= MESSAGE_LIMIT:
+            return await self.submit(lane, chat_id, bot.send_message, chat_id=chat_id, text=text, **kwargs)
+        parts = split_text(text, html=str(kwargs.get('parse_mode', '')).upper() == 'HTML')
+        logger.info(f"消息长度 {text_length(text)} 超过上限，拆分为 {len(parts)} 条发送")
+        sent = None
+        for part in parts:
+            sent = await self.submit(lane, chat_id, bot.send_message, chat_id=chat_id, text=part, **kwargs)
+        return sent
+
+    def _next_job(self):
+        """Pop the first sendable job by lane, or return the seconds until one may be sendable."""
+        wait = None
+        for lane in sorted(self._lanes):
+            queue = self._lanes[lane]
+            skipped = set()
+            for index, job in enumerate(queue):
+                if job.future.done():
+                    del queue[index]
+                    return None, 0.0
+                if job.chat_id in skipped or job.chat_id in self._inflight:
+                    skipped.add(job.chat_id)
+                    continue
+                bucket = self._chat_bucket(job.chat_id)
+                delay = bucket.reserve(1)
+                if delay > 0:
+                    bucket.refund(1)
+                    skipped.add(job.chat_id)
+                    wait = delay if wait is None else min(wait, delay)
+                    continue
+                del queue[index]
+                return job, 0.0
+        return None, wait
+
+    async def _run(self):
+        while True:
+            if not self.queue_depth:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            pause = self._paused_until - time.monotonic()
+            if pause > 0:
+                await asyncio.sleep(pause)
+                continue
+
+            job, wait = self._next_job()
+            if job is None:
+                if wait is None or wait > 0:
+                    # 所有排队的群组都在等待额度或有消息正在发送，等到额度恢复或有新消息
+                    self._wakeup.clear()
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), timeout=wait or 1.0)
+                    except asyncio.TimeoutError:
+                        pass
+                continue
+
+            delay = self._global.reserve(1)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self._inflight.add(job.chat_id)
+            task = asyncio.create_task(self._send(job))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, job: _SendJob):
+        try:
+            result = await job.call()
+        except telegram.error.RetryAfter as e:
+            job.attempts += 1
+            self.stats['retry_after'] += 1
+            retry_after = e.retry_after.total_seconds() if hasattr(e.retry_after, 'total_seconds') else e.retry_after
+            self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+            logger.warning(f"Telegram限流，暂停所有发送 {retry_after} 秒")
+            if job.attempts >= self.max_attempts:
+                self.stats['failed'] += 1
+                if not job.future.done():
+                    job.future.set_exception(e)
+            else:
+                self._lanes[job.lane].appendleft(job)
+        except Exception as e:
+            self.stats['failed'] += 1
+            if not job.future.done():
+                job.future.set_exception(e)
+        else:
+            self.stats['sent'] += 1
+            if not job.future.done():
+                job.future.set_result(result)
+        finally:
+            self._inflight.discard(job.chat_id)
+            self._wakeup.set()
+
+    def summary(self) -> str:
+        """Return a one-line report of queued and sent messages."""
+        depths = {Lane(lane).name: len(queue) for lane, queue in self._lanes.items()}
+        return (f"消息发送：排队 {self.queue_depth} {depths}，已发送 {self.stats['sent']}，"
+                f"失败 {self.stats['failed']}，限流暂停 {self.stats['retry_after']} 次")
+
+
+_dispatchers: Dict[str, SendDispatcher] = {}
+_dispatchers_lock = threading.Lock()
+
+
+def get_send_dispatcher(bot) -> SendDispatcher:
+    """Return the dispatcher of ``bot``; Telegram rate limits apply per bot token."""
+    with _dispatchers_lock:
+        dispatcher = _dispatchers.get(bot.token)
+        if dispatcher is None:
+            dispatcher = SendDispatcher()
+            _dispatchers[bot.token] = dispatcher
+        return dispatcher
@@ -0,0 +1,89 @@
+import html
+import time
+from collections import OrderedDict
+from typing import Iterable, Optional, Tuple
+from telethon.utils import get_peer_id
+from config.settings import settings
+
+logger = settings.get_logger(__name__)
+
+UNKNOWN_SENDER = ("未知用户", "未知用户")
+
+
+class SenderCache:
+    """Bounded LRU of pre-rendered sender names keyed by sender ID.
+
+    Entries are keyed by the marked peer ID (``-100…`` for channels), the same
+    form as ``message.sender_id``. Each entry holds an HTML rendering (with a
+    profile link and the name escaped) for alerts and a plain-text rendering
+    for history dumps. Entries are filled in bulk from the
+    users and chats that come with every update and expire after ``ttl``
+    seconds, so renamed users are picked up again.
+    """
+
+    def __init__(self, max_size: int = None, ttl: float = None):
+        self.max_size = max_size or settings.sender_cache_size
+        self.ttl = settings.sender_cache_ttl if ttl is None else ttl
+        self._entries: OrderedDict = OrderedDict()
+        self.stats = {'hits': 0, 'misses': 0}
+
+    @staticmethod
+    def render(entity) -> Optional[Tuple[str, str]]:
+        """Return ``(html, plain)`` for a user or channel entity."""
+        username = getattr(entity, 'username', None)
+        if username:
+            return f"@{username} (<a href=\"https://t.me/{username}\">用户链接</a>)", f"@{username}"
+        first_name = getattr(entity, 'first_name', None)
+        if first_name:
+            name = first_name
+            if getattr(entity, 'last_name', None):
+                name += f" {entity.last_name}"
+            # HTML形式用于ParseMode.HTML的告警，名字中的<、&等字符必须转义，否则整条消息被拒绝
+            return f"{html.escape(name)} (<a href=\"tg://user?id={entity.id}\">用户链接</a>)", name
+        title = getattr(entity, 'title', None)
+        if title:
+            return html.escape(title), title
+        return None
+
+    def add(self, entity):
+        rendered = self.render(entity)
+        if rendered is None:
+            return
+        try:
+            # 频道和匿名管理员发送的消息，sender_id是带-100前缀的ID，与entity.id不同
+            key = get_peer_id(entity)
+        except (TypeError, ValueError):
+            return
+        self._entries[key] = (time.monotonic() + self.ttl, rendered)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def add_entities(self, entities: Iterable):
+        """Cache every entity that came with an update or a history response."""
+        for entity in entities:
+            if entity is not None:
+                self.add(entity)
+
+    def get(self, sender_id) -> Optional[Tuple[str, str]]:
+        entry = self._entries.get(sender_id)
+        if entry is None:
+            return None
+        expires_at, rendered = entry
+        if expires_at < time.monotonic():
+            del self._entries[sender_id]
+            return None
+        self._entries.move_to_end(sender_id)
+        return rendered
+
+    def lookup(self, message) -> Tuple[str, str]:
+        """Return ``(html, plain)`` for the sender of ``message``."""
+        rendered = self.get(message.sender_id) if message.sender_id else None
+        if rendered is not None:
+            self.stats['hits'] += 1
+            return rendered
+        self.stats['misses'] += 1
+        if message.sender:
+            self.add(message.sender)
+            return self.render(message.sender) or UNKNOWN_SENDER
+        return UNKNOWN_SENDER
@@ -0,0 +1,100 @@
+import re
+from typing import Iterator, List, Tuple
+
+# Telegram单条消息的最大长度（UTF-16码元）
+MESSAGE_LIMIT = 4096
+
+# Telegram的ParseMode.HTML支持的标签
+_HTML_TAGS = {'b', 'strong', 'i', 'em', 'u', 'ins', 's', 'strike', 'del', 'a', 'code', 'pre',
+              'span', 'tg-spoiler', 'tg-emoji', 'blockquote'}
+_TAG = re.compile(r'<(/?)([a-zA-Z][\w-]*)[^<>]*>')
+
+
+def text_length(text: str) -> int:
+    """Length of ``text`` as Telegram counts it, in UTF-16 code units."""
+    return len(text.encode('utf-16-le')) // 2
+
+
+def _scan_tags(text: str, stack: List[Tuple[str, str]]) -> List[Tuple[str, str]]:
+    """Return the open-tag stack after ``text``, given the stack before it."""
+    stack = list(stack)
+    for match in _TAG.finditer(text):
+        name = match.group(2).lower()
+        if name not in _HTML_TAGS:
+            continue
+        if not match.group(1):
+            stack.append((name, match.group(0)))
+            continue
+        for index in range(len(stack) - 1, -1, -1):
+            if stack[index][0] == name:
+                del stack[index]
+                break
+    return stack
+
+
+def _closing(stack) -> str:
+    return ''.join(f"</{name}>" for name, _ in reversed(stack))
+
+
+def _reopening(stack) -> str:
+    return ''.join(tag for _, tag in stack)
+
+
+def _hard_cut(line: str, size: int, html: bool) -> Iterator[str]:
+    """Cut a line longer than ``size``, preferring spaces and never inside a tag or entity."""
+    while text_length(line) > size:
+        cut = min(size, len(line))
+        while text_length(line[:cut]) > size:
+            cut -= 1
+        space = line.rfind(' ', 0, cut)
+        if space > cut // 2:
+            cut = space + 1
+        if html:
+            head = line[:cut]
+            tag_start = head.rfind('<')
+            if tag_start > head.rfind('>') and tag_start > 0:
+                cut = tag_start
+            entity_start = line.rfind('&', 0, cut)
+            if entity_start > line.rfind(';', 0, cut) and cut - entity_start <= 10 and entity_start > 0:
+                cut = entity_start
+        yield line[:cut]
+        line = line[cut:]
+    yield line
+
+
+def _segments(text: str, size: int, html: bool) -> Iterator[Tuple[str, str]]:
+    """Yield ``(separator, piece)`` pairs: paragraphs, or lines and cuts of paragraphs above ``size``."""
+    for paragraph_index, paragraph in enumerate(text.split('\n\n')):
+        paragraph_separator = '\n\n' if paragraph_index else ''
+        if text_length(paragraph) <= size:
+            yield paragraph_separator, paragraph
+            continue
+        for line_index, line in enumerate(paragraph.split('\n')):
+            line_separator = '\n' if line_index else paragraph_separator
+            for cut_index, piece in enumerate(_hard_cut(line, size, html)):
+                yield (line_separator if cut_index == 0 else ''), piece
+
+
+def split_text(text: str, limit: int = MESSAGE_LIMIT, html: bool = False) -> List[str]:
+    """Split ``text`` into parts of at most ``limit`` characters for separate messages.
+
+    Parts break on paragraph boundaries where possible, then on line
+    boundaries, and only cut inside a line that alone is too long. With
+    ``html`` the tags still open at a break are closed at the end of the part
+    and reopened at the start of the next one, and no tag or entity is cut.
+    """
+    if text_length(text) <= limit:
+        return [text]
+    parts, current, stack = [], '', []
+    # 单个片段不超过上限的一半，留出补全和重新打开标签的空间
+    for separator, piece in _segments(text, limit // 2, html):
+        new_stack = _scan_tags(piece, stack) if html else stack
+        candidate = f"{current}{separator}{piece}" if current else piece
+        if text_length(candidate) + text_length(_closing(new_stack)) <= limit:
+            current, stack = candidate, new_stack
+            continue
+        parts.append(current + _closing(stack))
+        current, stack = _reopening(stack) + piece, new_stack
+    if current:
+        parts.append(current + _closing(stack))
+    return [part for part in parts if part.strip()]
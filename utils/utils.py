@@ -1,57 +1,213 @@
+import asyncio
+import threading
+import weakref
 from datetime import datetime
-from typing import List, Dict, Optional
-from openai import OpenAI
+from typing import AsyncIterator, List, Dict, Optional
+from openai import AsyncOpenAI, OpenAI, DefaultAsyncHttpxClient, DefaultHttpxClient
+import httpx
 from config.settings import settings
 from smolagents import CodeAgent, OpenAIServerModel, tool
 import re
 import json
+from utils.llm_cache import LLMCache
+from utils.llm_scheduler import LLMScheduler, Priority, estimate_tokens
+from utils.model_router import ModelRouter
 
 logger = settings.get_logger(__name__)
 
 class OpenAIService:
-    """Service class for OpenAI API interactions."""
-    def __init__(self):
+    """Process-wide LLM engine shared by every call site.
+
+    ``OpenAIService()`` always returns the same instance. The query bot and the
+    forward bot run their own event loops in separate threads and an httpx pool
+    cannot be shared across loops, so one pooled async client is kept per loop.
+    """
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __new__(cls):
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    instance = super().__new__(cls)
+                    instance._setup()
+                    cls._instance = instance
+        return cls._instance
+
+    def _setup(self):
+        """Create the shared sync client and the smolagents model."""
+        self._clients_lock = threading.Lock()
+        self._async_clients = weakref.WeakKeyDictionary()
+        self._schedulers = weakref.WeakKeyDictionary()
+        # 同步客户端仅供smolagents工具在线程中使用
         self.client = OpenAI(
             api_key=settings.openai_api_key,
-            base_url=settings.openai_base_url
+            base_url=settings.openai_base_url,
+            timeout=settings.openai_timeout,
+            max_retries=0,
+            http_client=DefaultHttpxClient(limits=self._limits())
         )
         self.model = OpenAIServerModel(
             model_id=settings.model_id,
             api_base=settings.openai_base_url,
             api_key=settings.openai_api_key
         )
+        self.cache = LLMCache()
+        self.router = ModelRouter()
+
+    @staticmethod
+    def _limits() -> httpx.Limits:
+        return httpx.Limits(
+            max_connections=settings.openai_max_connections,
+            max_keepalive_connections=settings.openai_max_connections
+        )
+
+    @property
+    def async_client(self) -> AsyncOpenAI:
+        """Return the pooled async client bound to the running event loop."""
+        loop = asyncio.get_running_loop()
+        client = self._async_clients.get(loop)
+        if client is None:
+            with self._clients_lock:
+                client = self._async_clients.get(loop)
+                if client is None:
+                    client = AsyncOpenAI(
+                        api_key=settings.openai_api_key,
+                        base_url=settings.openai_base_url,
+                        timeout=settings.openai_timeout,
+                        max_retries=0,
+                        http_client=DefaultAsyncHttpxClient(limits=self._limits())
+                    )
+                    self._async_clients[loop] = client
+        return client
+
+    @property
+    def scheduler(self) -> LLMScheduler:
+        """Return the request scheduler of the running event loop."""
+        loop = asyncio.get_running_loop()
+        scheduler = self._schedulers.get(loop)
+        if scheduler is None:
+            scheduler = LLMScheduler()
+            self._schedulers[loop] = scheduler
+        return scheduler
 
-    def infer(self, user_prompt: str, system_prompt: str = None, model: str = None, temperature: float = 0.6) -> str:
-        """Make an inference using OpenAI API."""
-        retries = 3
-        for attempt in range(retries):
+    @staticmethod
+    def _build_messages(user_prompt: str, system_prompt: str = None) -> list:
+        messages = []
+        if system_prompt:
+            messages.append({"role": "system", "content": system_prompt})
+        messages.append({"role": "user", "content": user_prompt})
+        return messages
+
+    @staticmethod
+    def parse_response(res_raw: str):
+        """Return the first ```json block of a completion parsed, or the raw text."""
+        pattern = re.compile(r'```json\s*([\s\S]*?)\s*```')
+        matches = pattern.findall(res_raw)
+        if matches:
             try:
-                completion = self.client.chat.completions.create(
-                    model=model or settings.model_id,
-                    messages=[
-                        {"role": "system", "content": system_prompt} if system_prompt else None,
-                        {"role": "user", "content": user_prompt}
-                    ],
-                    timeout=300,
-                    temperature=temperature
-                )
-                res_raw = completion.choices[0].message.content
-                
-                # Try to parse JSON if present
-                pattern = re.compile(r'```json\s*([\s\S]*?)\s*```')
-                matches = pattern.findall(res_raw)
-                if matches:
-                    try:
-                        return json.loads(matches[0], strict=False)
-                    except json.JSONDecodeError as e:
-                        logger.error(f"JSON Decode Error: {e}")
-                        return res_raw
+                return json.loads(matches[0], strict=False)
+            except json.JSONDecodeError as e:
+                logger.error(f"JSON Decode Error: {e}")
                 return res_raw
-                
-            except Exception as e:
-                logger.error(f"OpenAI API call failed (attempt {attempt + 1}/{retries}): {e}")
-                if attempt == retries - 1:
-                    raise
+        return res_raw
+
+    async def infer(self, user_prompt: str, system_prompt: str = None, model: str = None, temperature: float = 0.6,
+                    cache_ttl: float = None, priority: int = Priority.BACKGROUND, chat_key=None, route: str = None):
+        """Make an inference using OpenAI API without blocking the event loop.
+
+        When ``cache_ttl`` is set, identical requests within the TTL are answered
+        from the LLM cache instead of the provider. Requests that reach the
+        provider are ordered by ``priority`` and shared fairly between
+        ``chat_key`` values by the scheduler. With ``route`` and no explicit
+        ``model``, the model comes from the router, which may hedge a slow
+        primary with the route's fallback model.
+        """
+        if route and not model:
+            model = self.router.model_for(route)
+        model = model or settings.model_id
+        cache_key = None
+        if cache_ttl:
+            cache_key = LLMCache.make_key(model, system_prompt, user_prompt, temperature)
+            cached = await self.cache.aget(cache_key)
+            if cached is not None:
+                return cached
+
+        if route and model == self.router.model_for(route):
+            result = await self.router.run(
+                route, lambda routed_model: self._complete(routed_model, user_prompt, system_prompt, temperature, priority, chat_key)
+            )
+        else:
+            result = await self._complete(model, user_prompt, system_prompt, temperature, priority, chat_key)
+        if cache_key:
+            await self.cache.aset(cache_key, result, cache_ttl)
+        return result
+
+    async def _complete(self, model: str, user_prompt: str, system_prompt: str, temperature: float, priority: int, chat_key):
+        estimated_tokens = estimate_tokens(system_prompt, user_prompt)
+        async with self.scheduler.slot(model, priority, chat_key, estimated_tokens) as token_bucket:
+            retries = 3
+            for attempt in range(retries):
+                try:
+                    completion = await self.async_client.chat.completions.create(
+                        model=model,
+                        messages=self._build_messages(user_prompt, system_prompt),
+                        temperature=temperature
+                    )
+                    # 用实际消耗的token数修正预估值
+                    if completion.usage:
+                        token_bucket.refund(estimated_tokens - completion.usage.total_tokens)
+                    return self.parse_response(completion.choices[0].message.content)
+                    
+                except Exception as e:
+                    logger.error(f"OpenAI API call failed ({model}, attempt {attempt + 1}/{retries}): {e}")
+                    if attempt == retries - 1:
+                        raise
+
+    async def stream_infer(self, user_prompt: str, system_prompt: str = None, model: str = None, temperature: float = 0.6,
+                           cache_ttl: float = None, priority: int = Priority.INTERACTIVE, chat_key=None,
+                           route: str = None) -> AsyncIterator[str]:
+        """Stream a completion as text deltas.
+
+        Takes the same scheduling, caching and routing parameters as ``infer``; a
+        cache hit is yielded as a single chunk. Streams are never hedged, since
+        the first chunks are already on screen when a fallback would start.
+        """
+        if route and not model:
+            model = self.router.model_for(route)
+        model = model or settings.model_id
+        cache_key = None
+        if cache_ttl:
+            cache_key = LLMCache.make_key(model, system_prompt, user_prompt, temperature)
+            cached = await self.cache.aget(cache_key)
+            if cached is not None:
+                yield cached if isinstance(cached, str) else json.dumps(cached, ensure_ascii=False)
+                return
+
+        parts = []
+        async with self.scheduler.slot(model, priority, chat_key, estimate_tokens(system_prompt, user_prompt)):
+            retries = 3
+            for attempt in range(retries):
+                try:
+                    stream = await self.async_client.chat.completions.create(
+                        model=model,
+                        messages=self._build_messages(user_prompt, system_prompt),
+                        temperature=temperature,
+                        stream=True
+                    )
+                    break
+                except Exception as e:
+                    logger.error(f"OpenAI streaming call failed (attempt {attempt + 1}/{retries}): {e}")
+                    if attempt == retries - 1:
+                        raise
+
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    parts.append(chunk.choices[0].delta.content)
+                    yield chunk.choices[0].delta.content
+
+        if cache_key and parts:
+            await self.cache.aset(cache_key, ''.join(parts), cache_ttl)
 
 
 async def parse_query(query: str, date: str) -> List[Dict]:
@@ -78,30 +234,39 @@ async def parse_query(query: str, date: str) -> List[Dict]:
     
     **请严格按照上面json格式返回，不要返回任何多余内容或注释**
     """
-    openai_service = OpenAIService()
-    
-    analysis_result = openai_service.infer(user_prompt=analyze_query_prompt, system_prompt='你是一个关键词提取大师')
+    analysis_result = await OpenAIService().infer(
+        user_prompt=analyze_query_prompt,
+        system_prompt='你是一个关键词提取大师',
+        cache_ttl=settings.llm_cache_ttls['parse_query'],
+        priority=Priority.INTERACTIVE,
+        route='parse_query'
+    )
     return analysis_result
 
 
-def analyze_content(news_list: List[str], user_question: str, task_type: str = "新闻") -> str:
-    """Analyze news or posts content and answer user questions."""
-    prompt = f"""下面是一个{task_type}列表，请总结这个列表里的{task_type}内容，并回答用户提问。
+ANALYZE_CONTENT_SYSTEM_PROMPT = "你是一个文本内容分析师，擅长对文本内容进行分析总结，并根据总结回答用户提问。"
+
+def _build_analyze_content_prompt(news_list: List[str], user_question: str, task_type: str) -> str:
+    return f"""下面是一个{task_type}列表，请总结这个列表里的{task_type}内容，并回答用户提问。
     {task_type}列表：
     {news_list}
 
     用户提问：
     {user_question}"""
-    
-    openai_service = OpenAIService()
-    
-    return openai_service.infer(
-        user_prompt=prompt,
-        system_prompt="你是一个文本内容分析师，擅长对文本内容进行分析总结，并根据总结回答用户提问。"
+
+def analyze_content_stream(news_list: List[str], user_question: str, task_type: str = "新闻", chat_key=None) -> AsyncIterator[str]:
+    """Analyze news or posts content and answer user questions, yielding the answer as it is generated."""
+    return OpenAIService().stream_infer(
+        user_prompt=_build_analyze_content_prompt(news_list, user_question, task_type),
+        system_prompt=ANALYZE_CONTENT_SYSTEM_PROMPT,
+        cache_ttl=settings.llm_cache_ttls['analyze_content'],
+        priority=Priority.INTERACTIVE,
+        chat_key=chat_key,
+        route='analyze_content'
     )
     
 
-def summarize_tweets(tweets: list) -> list:
+async def summarize_tweets(tweets: list, priority: int = Priority.INTERACTIVE, chat_key=None) -> list:
     logger.info("Summarizing and translating tweets...")
     
     # 语言代码到中文名称的映射
@@ -339,11 +504,13 @@ Example output:
 {concise_tweets}
 """
 
-    openai_service = OpenAIService()
-    
-    return openai_service.infer(
+    return await OpenAIService().infer(
         user_prompt=prompt,
-        system_prompt="你是一个专业的翻译和总结专家，能够对社媒帖子内容进行准确的总结和翻译。"
+        system_prompt="你是一个专业的翻译和总结专家，能够对社媒帖子内容进行准确的总结和翻译。",
+        cache_ttl=settings.llm_cache_ttls['summarize_tweets'],
+        priority=priority,
+        chat_key=chat_key,
+        route='summarize_tweets'
     )
     
 
@@ -358,9 +525,11 @@ def write_tweets_ids(ids):
         json.dump(ids, f)
         return
     
-async def analyze_message(message: str) -> dict:
-    """Analyze telegram group message"""
-    prompt = f"""下面是一条telegram群组消息，请分析这条消息表达的含义，判断该条消息是否符合下面三种情况之一：
+ANALYZE_MESSAGE_SYSTEM_PROMPT = "你是一个专业的舆情与非法信息监控专家，能够准确的分析消息内容，判断该消息是否是舆情风险信息。"
+
+def build_analyze_message_prompt(message: str) -> str:
+    """Build the single-message classification prompt used by analyze_message"""
+    return f"""下面是一条telegram群组消息，请分析这条消息表达的含义，判断该条消息是否符合下面三种情况之一：
     1. 是否是有关于**中国领导人**的负面**新闻报道**（如关于习近平或其他中国领导人的**新闻报道**，如果只是用户评论而非新闻报道，则不符合该条）
     2. 是否表示要在**中国境内**进行非法活动（如：我要炸车站，我要挂横幅，我要去抗议，如果是在除了中国境内的地方，则不符合）
     3. 他国政要涉及中国的观点和新政策（如：赖清德涉华观点）
@@ -375,17 +544,80 @@ async def analyze_message(message: str) -> dict:
     Telegram group message：
     {message}
     """
-    
+
+async def analyze_message(message: str, low_priority: bool = False) -> dict:
+    """Analyze telegram group message"""
+    return await OpenAIService().infer(
+        user_prompt=build_analyze_message_prompt(message),
+        system_prompt=ANALYZE_MESSAGE_SYSTEM_PROMPT,
+        cache_ttl=settings.llm_cache_ttls['analyze_message'],
+        priority=Priority.LOW if low_priority else Priority.BACKGROUND,
+        route='analyze_message'
+    )
+
+async def analyze_messages_batch(messages: Dict[str, str], low_priority: bool = False) -> Dict[str, dict]:
+    """Analyze a batch of telegram group messages in one request, keyed by message id
+
+    Verdicts are cached under the same key a single analyze_message call would
+    use, so a message seen before never reaches the provider again.
+    """
     openai_service = OpenAIService()
-    
-    return openai_service.infer(
+    ttl = settings.llm_cache_ttls['analyze_message']
+    model = openai_service.router.model_for('analyze_message')
+    cache_keys = {
+        message_id: LLMCache.make_key(model, ANALYZE_MESSAGE_SYSTEM_PROMPT, build_analyze_message_prompt(text), 0.6)
+        for message_id, text in messages.items()
+    }
+    verdicts = {}
+    for message_id, cache_key in cache_keys.items():
+        cached = await openai_service.cache.aget(cache_key)
+        if isinstance(cached, dict):
+            verdicts[message_id] = cached
+    if len(verdicts) == len(messages):
+        return verdicts
+
+    message_list = [{"id": message_id, "message": text} for message_id, text in messages.items() if message_id not in verdicts]
+    prompt = f"""下面是一个telegram群组消息列表，每个列表项包含消息id和消息内容，请逐条分析每条消息表达的含义，判断每条消息是否符合下面三种情况之一：
+    1. 是否是有关于**中国领导人**的负面**新闻报道**（如关于习近平或其他中国领导人的**新闻报道**，如果只是用户评论而非新闻报道，则不符合该条）
+    2. 是否表示要在**中国境内**进行非法活动（如：我要炸车站，我要挂横幅，我要去抗议，如果是在除了中国境内的地方，则不符合）
+    3. 他国政要涉及中国的观点和新政策（如：赖清德涉华观点）
+
+    请根据上述情况，分别判断每条消息是否是舆情风险信息，每条消息的判断互相独立，并以json格式返回判断结果。
+    **请严格按照下面json格式返回，列表中每条消息对应且仅对应一个结果，不要返回任何多余内容或注释**
+    ```json
+    [
+        {{
+            "id": "对应消息的id",
+            "is_illegal_comment": true 或 false, // 是否是非法评论, 如果符合上述情况之一则返回true，否则返回false，**如果是用户个人对中国领导人的评价评论，而非新闻报道，则返回false**
+            "reason": "对该消息内容的总结，以及判断该条消息是否为舆情风险信息的原因"
+        }}
+    ]
+    ```
+
+    Telegram group messages：
+    {json.dumps(message_list, ensure_ascii=False)}
+    """
+
+    result = await openai_service.infer(
         user_prompt=prompt,
-        system_prompt="你是一个专业的舆情与非法信息监控专家，能够准确的分析消息内容，判断该消息是否是舆情风险信息。"
+        system_prompt=ANALYZE_MESSAGE_SYSTEM_PROMPT,
+        priority=Priority.LOW if low_priority else Priority.BACKGROUND,
+        route='analyze_message'
     )
-    
-async def analyze_scheduled_messages(messages: list) -> str:
-    """Analyze scheduled telegram group messages"""
-    prompt = f"""下面我会传递给你一个list，其中每一个列表项是一个dict，该dict的group_name键值表达某个telegram群组名，messages键值表达该telegram群组在半小时内的消息记录，请分析这组消息表达的含义，总结在这半小时内每个群组的主要讨论内容，并从负面信息和非法行为预警两个维度进行归纳。最终以字符串形式返回你的总结归纳结果。
+    if not isinstance(result, list):
+        logger.error(f"批量分析返回格式错误: {result}")
+        return verdicts
+    for item in result:
+        if not isinstance(item, dict) or str(item.get('id')) not in cache_keys:
+            continue
+        message_id = str(item['id'])
+        verdicts[message_id] = item
+        await openai_service.cache.aset(cache_keys[message_id], item, ttl)
+    return verdicts
+
+def _build_scheduled_prompt(messages: list) -> str:
+    """Build the half-hour group summary prompt for a list of {group_name, messages} dicts"""
+    return f"""下面我会传递给你一个list，其中每一个列表项是一个dict，该dict的group_name键值表达某个telegram群组名，messages键值表达该telegram群组在半小时内的消息记录，请分析这组消息表达的含义，总结在这半小时内每个群组的主要讨论内容，并从负面信息和非法行为预警两个维度进行归纳。最终以字符串形式返回你的总结归纳结果。
     其中负面信息的含义是：有关于**中国领导人**的负面评价（如关于习近平或其他中国领导人的负面评价）
     非法行为的含义是：用户表示计划在**中国境内**进行非法活动（如：我要炸车站，我要挂横幅，我要去抗议，如果是在除了中国境内的地方，则不符合）
     
@@ -419,10 +651,125 @@ async def analyze_scheduled_messages(messages: list) -> str:
     Telegram group messages：
     {messages}
     """
-    
-    openai_service = OpenAIService()
-    
-    return openai_service.infer(
-        user_prompt=prompt,
-        system_prompt="你是一个专业的舆情与非法信息监控专家，能够准确的分析多条聊天记录，并进行总结和归纳。"
-    )
\ No newline at end of file
+
+SCHEDULED_SYSTEM_PROMPT = "你是一个专业的舆情与非法信息监控专家，能够准确的分析多条聊天记录，并进行总结和归纳。"
+
+def _chunk_scheduled_messages(messages: list, budget: int) -> List[list]:
+    """Pack {group_name, messages} dicts into chunks whose estimated size fits ``budget``.
+
+    Small groups share a chunk; a group larger than the budget is split across
+    several chunks under the same group_name.
+    """
+    chunks = []
+    current, current_size = [], 0
+    for group in messages:
+        part = {'group_name': group['group_name'], 'messages': []}
+        for text in group['messages']:
+            size = estimate_tokens(text) + 4
+            if current_size + size > budget and (part['messages'] or current):
+                if part['messages']:
+                    current.append(part)
+                chunks.append(current)
+                current, current_size = [], 0
+                part = {'group_name': group['group_name'], 'messages': []}
+            part['messages'].append(text)
+            current_size += size
+        if part['messages']:
+            current.append(part)
+    if current:
+        chunks.append(current)
+    return chunks
+
+# 合并分段总结的最大轮数，超过后直接拼接剩余总结
+MAX_REDUCE_ROUNDS = 5
+
+async def _reduce_scheduled_summaries(summaries: List[str], budget: int, chat_key=None) -> str:
+    """Merge partial half-hour summaries, in several rounds if they exceed ``budget``
+
+    Summaries are never truncated. One that alone exceeds the budget is passed
+    to the next round unchanged, and whatever cannot be merged within the
+    budget or ``MAX_REDUCE_ROUNDS`` rounds is concatenated.
+    """
+    for _ in range(MAX_REDUCE_ROUNDS):
+        if len(summaries) <= 1:
+            return summaries[0]
+        groups, current, current_size = [], [], 0
+        for summary in summaries:
+            size = estimate_tokens(summary)
+            if current and current_size + size > budget:
+                groups.append(current)
+                current, current_size = [], 0
+            if size > budget:
+                # 截断会丢掉总结中的群组，超出预算的总结单独进入下一轮
+                groups.append([summary])
+                continue
+            current.append(summary)
+            current_size += size
+        if current:
+            groups.append(current)
+        if all(len(group) == 1 for group in groups):
+            # 没有可以在预算内合并的总结，再继续也不会减少
+            break
+
+        prompt_template = """下面是同一批telegram群组在近半小时内消息的多份分段总结，这些总结是按消息分段分别生成的，同一个群组可能出现在多份总结中。
+    请将它们合并为一份完整的总结：同一群组名的内容合并到一起，去除重复内容，保留所有负面信息和非法行为的归纳，不要遗漏任何群组。
+    请严格保持与分段总结相同的字符串格式返回（群组名、内容总结、负面信息、非法行为），不要返回任何多余内容或注释。
+
+    分段总结：
+    {summaries}
+    """
+        summaries = await asyncio.gather(*(
+            OpenAIService().infer(
+                user_prompt=prompt_template.format(summaries='\n\n'.join(group)),
+                system_prompt=SCHEDULED_SYSTEM_PROMPT,
+                priority=Priority.REPORT,
+                chat_key=chat_key,
+                route='analyze_scheduled_messages'
+            ) if len(group) > 1 else asyncio.sleep(0, result=group[0])
+            for group in groups
+        ))
+        summaries = [str(summary).replace("```", "").replace("plaintext", "") for summary in summaries]
+    if len(summaries) > 1:
+        logger.warning(f"分段总结无法在预算和 {MAX_REDUCE_ROUNDS} 轮以内合并完，直接拼接剩余的 {len(summaries)} 份总结")
+    return '\n\n'.join(summaries)
+
+async def analyze_scheduled_messages(messages: list, chat_key=None) -> str:
+    """Analyze scheduled telegram group messages
+
+    Windows larger than ``settings.summary_token_budget`` are summarized
+    map-reduce style: chunks of groups are summarized in parallel, then the
+    partial summaries are merged.
+    """
+    messages = list(messages)
+    budget = settings.summary_token_budget
+    chunks = _chunk_scheduled_messages(messages, budget)
+    if len(chunks) <= 1:
+        return await OpenAIService().infer(
+            user_prompt=_build_scheduled_prompt(messages),
+            system_prompt=SCHEDULED_SYSTEM_PROMPT,
+            priority=Priority.REPORT,
+            chat_key=chat_key,
+            route='analyze_scheduled_messages'
+        )
+
+    logger.info(f"半小时消息超出单次预算，拆分为 {len(chunks)} 段并行总结")
+    partials = await asyncio.gather(*(
+        OpenAIService().infer(
+            user_prompt=_build_scheduled_prompt(chunk),
+            system_prompt=SCHEDULED_SYSTEM_PROMPT,
+            priority=Priority.REPORT,
+            chat_key=chat_key,
+            route='analyze_scheduled_messages'
+        )
+        for chunk in chunks
+    ), return_exceptions=True)
+
+    summaries = []
+    for chunk, partial in zip(chunks, partials):
+        if isinstance(partial, Exception):
+            logger.error(f"分段总结失败（{[group['group_name'] for group in chunk]}）: {partial}")
+            continue
+        summaries.append(str(partial).replace("```", "").replace("plaintext", ""))
+    if not summaries:
+        raise RuntimeError("所有分段总结均失败")
+    return await _reduce_scheduled_summaries(summaries, budget, chat_key)
\ No newline at end of file